@@ -1,13 +1,47 @@
-from requests_html import HTMLSession
-from html2text import HTML2Text
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+from cassette import CASSETTE
+from instrumentation import TRACER
+from page_cache import PageCache
+from scheduler import RETRY_STATUSES, SCHEDULER, RetryableError
+from stop_words import TOKEN_PATTERN
+from text_extraction import extract_text
+from collections import Counter
+import threading
+import time
+import sys
 import re
 
-HTML_SESSION = HTMLSession()
-HTML_2_TEXT = HTML2Text()
-HTML_2_TEXT.ignore_links = True
+HTML_SESSION = None  # created by get_html_session, only with full text
+HTML_SESSION_LOCK = threading.Lock()
+USE_PAGE_CACHE = True
+PAGE_CACHE = PageCache()
+
+FETCH_TIMEOUT = 5  # seconds allowed for a single page, retries included
+MIN_ATTEMPT_TIMEOUT = 0.1  # seconds
+BATCH_TIMEOUT = 15  # seconds allowed for the whole page of results
+MAX_FETCH_WORKERS = 10
+MAX_FETCHES_PER_HOST = 2
+# Browser user agent, some sites refuse the default python-requests one
+USER_AGENT = ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) '
+              'AppleWebKit/603.3.8 (KHTML, like Gecko) Version/10.1.2 '
+              'Safari/603.3.8')
+
+NON_ALPHABET_PATTERN = re.compile(r'[^a-zA-Z\' ]+')
+
+HOST_LOCKS = {}
+HOST_LOCKS_GUARD = threading.Lock()
 
 
 class FormattedResponse():
+    '''
+    Compact search result. The joint text, its tokens (interned, so
+    results share the strings) and term counts are computed once and
+    reset only when the body changes.
+    '''
+    __slots__ = ('result_rank', 'url', 'description', 'title', 'duplicates',
+                 '__body', '__joint_text', '__tokens', '__term_counts')
+
     def __init__(self, google_response, result_rank, full_text=False):
         self.result_rank = result_rank
         self.url = google_response['formattedUrl']
@@ -21,29 +55,190 @@ class FormattedResponse():
         else:
             self.title = google_response['title']
 
-        self.body = ''
+        self.duplicates = []  # near-duplicate results it stands for
+        self.body = google_response.get('body', '')
         if full_text:
             self.body = self.get_body_from_url()
 
+    def as_item(self):
+        '''
+        The result in the shape of a Custom Search item, with the body
+        when it was fetched, e.g. to save a session
+        '''
+        item = {'formattedUrl': self.url, 'title': self.title,
+                'snippet': self.description}
+        if self.body:
+            item['body'] = self.body
+        return item
+
+    @property
+    def body(self):
+        return self.__body
+
+    @body.setter
+    def body(self, body):
+        self.__body = body
+        self.__joint_text = None
+        self.__tokens = None
+        self.__term_counts = None
+
     @property
     def joint_text(self):
-        return self.title + ' ' + self.description + ' ' + self.body
-
-    def get_body_from_url(self):
-        response = HTML_SESSION.get(self.url)
-        try:
-            body = response.html.find('body', first=True)
-        except:
-            body = ''
-        if not body:
-            return ''
-        return HTML_2_TEXT.handle(body.html)
+        if self.__joint_text is None:
+            self.__joint_text = ' '.join(
+                (self.title, self.description, self.body))
+        return self.__joint_text
+
+    @property
+    def tokenized_text(self):
+        '''
+        Lowercased word tokens of the result, computed once on first use
+        '''
+        if self.__tokens is None:
+            self.__tokens = [sys.intern(token) for token in
+                             TOKEN_PATTERN.findall(self.joint_text.lower())]
+        return self.__tokens
+
+    @property
+    def term_counts(self):
+        '''
+        Occurrences of each token, computed once on first use
+        '''
+        if self.__term_counts is None:
+            self.__term_counts = Counter(self.tokenized_text)
+        return self.__term_counts
+
+    def get_body_from_url(self, timeout=None):
+        '''
+        Text of the result's page, from the cassette when one is replayed
+        '''
+        if CASSETTE.replaying:
+            return CASSETTE.get_page(self.url) or ''
+        body_text = self.__download_body(timeout)
+        if CASSETTE.recording:
+            CASSETTE.put_page(self.url, body_text)
+        return body_text
+
+    def __download_body(self, timeout=None):
+        cached_page = None
+        headers = {}
+        if USE_PAGE_CACHE:
+            cached_page = PAGE_CACHE.get(self.url)
+            if cached_page and cached_page.is_fresh(PAGE_CACHE.ttl):
+                PAGE_CACHE.record('hits')
+                TRACER.count('page_cache_hits')
+                return cached_page.text
+            if cached_page:
+                headers = cached_page.conditional_headers
+
+        # Every attempt shares the timeout, so retries can't extend it
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def request():
+            remaining = timeout
+            if deadline is not None:
+                remaining = max(MIN_ATTEMPT_TIMEOUT,
+                                deadline - time.monotonic())
+            # Streamed, so the page is parsed while it downloads
+            response = get_html_session().get(
+                self.url, timeout=remaining, headers=headers, stream=True)
+            if response.status_code in RETRY_STATUSES:
+                response.close()
+                raise RetryableError(response.status_code,
+                                     response.headers.get('Retry-After'))
+            return response
+
+        # Rate limited per host and retried, shared with the api calls
+        response = SCHEDULER.call('pages', request,
+                                  host=urlparse(self.url).netloc.lower(),
+                                  deadline=deadline)
+        if cached_page and response.status_code == 304:
+            response.close()
+            PAGE_CACHE.record('revalidations')
+            TRACER.count('page_cache_revalidations')
+            PAGE_CACHE.refresh(cached_page)
+            return cached_page.text
+
+        with TRACER.span('text_extraction', url=self.url):
+            body_text, downloaded = extract_text(response)
+        TRACER.count('bytes_downloaded', downloaded)
+        if USE_PAGE_CACHE:
+            PAGE_CACHE.record('misses')
+            TRACER.count('page_cache_misses')
+        if USE_PAGE_CACHE and response.ok:
+            PAGE_CACHE.put(self.url, body_text,
+                           response.headers.get('ETag'),
+                           response.headers.get('Last-Modified'),
+                           title=self.title)
+        return body_text
 
     def __clean_string(self, string):
         '''
         Clean string from unwanted elements
         '''
-        alphabet_pattern = re.compile(r'[^a-zA-Z\' ]+')
         cleaned_string = string.replace('-', ' ')
-        cleaned_string = re.sub(alphabet_pattern, '', string).lower()
+        cleaned_string = NON_ALPHABET_PATTERN.sub('', cleaned_string).lower()
         return cleaned_string
+
+
+def get_html_session():
+    '''
+    Session shared by the page fetches, created (and requests imported)
+    the first time a page is downloaded
+    '''
+    global HTML_SESSION
+    with HTML_SESSION_LOCK:
+        if HTML_SESSION is None:
+            import requests
+            HTML_SESSION = requests.Session()
+            HTML_SESSION.headers['User-Agent'] = USER_AGENT
+        return HTML_SESSION
+
+
+def get_host_lock(url):
+    '''
+    Semaphore capping the number of simultaneous fetches to one host
+    '''
+    host = urlparse(url).netloc.lower()
+    with HOST_LOCKS_GUARD:
+        if host not in HOST_LOCKS:
+            HOST_LOCKS[host] = threading.BoundedSemaphore(MAX_FETCHES_PER_HOST)
+        return HOST_LOCKS[host]
+
+
+def fetch_body(response, timeout=FETCH_TIMEOUT):
+    '''
+    Downloads the body of a single result, returns '' on any failure
+    '''
+    with get_host_lock(response.url):
+        with TRACER.span('page_fetch', url=response.url):
+            try:
+                return response.get_body_from_url(timeout=timeout)
+            except Exception:
+                return ''
+
+
+def fetch_full_text(responses, timeout=FETCH_TIMEOUT,
+                    batch_timeout=BATCH_TIMEOUT):
+    '''
+    Downloads the bodies of all results in parallel.
+    Results whose fetch fails or does not finish within the batch timeout
+    keep an empty body, so they fall back to their title and snippet.
+    Input: list of FormattedResponse, per url timeout, whole batch timeout
+    Output: nothing returned, bodies are set in place
+    '''
+    if not responses:
+        return
+    executor = ThreadPoolExecutor(
+        max_workers=min(MAX_FETCH_WORKERS, len(responses)))
+    futures = {executor.submit(fetch_body, response, timeout): response
+               for response in responses}
+    done, not_done = wait(futures, timeout=batch_timeout)
+    # Bodies are only assigned here, so late fetches can't overwrite them
+    for future in done:
+        futures[future].body = future.result()
+    # Fetches not started yet are dropped (shutdown's cancel_futures needs
+    # Python 3.9)
+    for future in not_done:
+        future.cancel()
+    executor.shutdown(wait=False)
@@ -0,0 +1,242 @@
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import numpy as np
+import project1
+from corpus import IncrementalCorpus
+from HttpResponse import FormattedResponse
+
+'''
+Benchmarks of the query expansion hot path.
+Times each stage in isolation on synthetic result sets of growing size, in
+snippet only and full text modes, and saves the timings as a json baseline.
+Startup (a new interpreter importing the program, as every CLI session
+does) is timed too, so slow imports show up as regressions.
+
+    python3 benchmark.py run <output json> [<sizes, e.g. 10,100,1000>]
+    python3 benchmark.py compare <baseline json> <new json> [<tolerance>]
+
+compare exits with status 1 if any stage got slower than the tolerance
+(a fraction, 0.2 by default) allows.
+'''
+
+'''
+Fixed Values
+'''
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+MODES = {'snippet': 0, 'full_text': 1000}  # body words per document
+VOCABULARY_SIZE = 50000
+SNIPPET_WORDS = 30
+REPEATS = 5
+OLD_MAX_TOKENS = 40000  # project1_old is quadratic, skip larger sets
+OLD_REPEATS = 1  # and time it only once
+DEFAULT_TOLERANCE = 0.2
+QUERY = 'w1 w2'
+STARTUP_COMMANDS = {  # name -> interpreter arguments
+    'import_project1': ['-c', 'import project1'],
+    'import_service': ['-c', 'import service'],
+    'project1_usage': ['project1.py'],  # exits after printing the format
+}
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def generate_results(n_docs, body_words, seed=0):
+    '''
+    Synthetic results with Zipf distributed words and random judgments
+    Input: number of documents, words of full text per document, seed
+    Output: list of FormattedResponse, relevance feedback dictionary
+    '''
+    rng = random.Random(seed)
+    words = [f'w{i}' for i in range(VOCABULARY_SIZE)]
+    cum_weights = list(itertools.accumulate(
+        1 / (rank + 1) for rank in range(VOCABULARY_SIZE)))
+
+    def text(n_words):
+        return ' '.join(rng.choices(words, cum_weights=cum_weights,
+                                    k=n_words))
+
+    results = []
+    for i in range(n_docs):
+        result = FormattedResponse({'formattedUrl': f'https://example.com/{i}',
+                                    'title': text(8),
+                                    'snippet': text(SNIPPET_WORDS)}, i % 10)
+        result.body = text(body_words)
+        results.append(result)
+
+    feedback = {project1.RELEVANT_KEYWORD: [],
+                project1.NOT_RELEVANT_KEYWORD: []}
+    for i, result in enumerate(results):
+        relevant = i == 0 or (i != 1 and rng.random() < 0.4)
+        keyword = (project1.RELEVANT_KEYWORD if relevant
+                   else project1.NOT_RELEVANT_KEYWORD)
+        feedback[keyword].append(result)
+    return results, feedback
+
+
+def indexed_corpus(results, feedback):
+    corpus = IncrementalCorpus()
+    corpus.add_documents(results)
+    corpus.add_judgments(feedback, project1.RELEVANT_KEYWORD,
+                         project1.NOT_RELEVANT_KEYWORD)
+    return corpus
+
+
+def time_stage(function, repeats=REPEATS):
+    '''
+    Runs function repeatedly, silencing its output
+    Output: dictionary with min and median seconds
+    '''
+    timings = []
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+    return {'min': min(timings), 'median': statistics.median(timings)}
+
+
+def time_startup(arguments, repeats=REPEATS):
+    '''
+    Runs a new interpreter repeatedly
+    Input: interpreter arguments
+    Output: dictionary with min and median seconds
+    '''
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, cwd=REPO_DIR,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return {'min': min(timings), 'median': statistics.median(timings)}
+
+
+def get_stages(results, feedback):
+    '''
+    Stage name -> function timing that stage alone
+    '''
+    corpus = indexed_corpus(results, feedback)
+    corpus.tfidf_matrix()
+    q_m_vector = project1.compute_rocchio_query_vector(QUERY, corpus)
+    best_words = project1.get_best_words(q_m_vector, corpus, QUERY)
+    stages = {
+        'get_augmented_query': lambda: project1.get_augmented_query(
+            QUERY, results, feedback, IncrementalCorpus()),
+        'corpus_indexing': lambda: indexed_corpus(results, feedback),
+        'compute_rocchio_query_vector':
+            lambda: project1.compute_rocchio_query_vector(QUERY, corpus),
+        'get_best_words':
+            lambda: project1.get_best_words(q_m_vector, corpus, QUERY),
+        'compute_bim_words': lambda: project1.compute_bim_words(
+            QUERY, corpus),
+        'compose_query': lambda: project1.compose_query(
+            QUERY, best_words, corpus,
+            np.flatnonzero(corpus.relevance == 1)),
+    }
+    old_module = load_project1_old()
+    n_tokens = sum(len(result.tokenized_text) for result in results)
+    if old_module and n_tokens <= OLD_MAX_TOKENS:
+        terms_set = old_module.compute_terms_set(results)
+        stages['old_get_terms_odds_params'] = \
+            lambda: old_module.get_terms_odds_params(terms_set, feedback)
+    return stages
+
+
+def load_project1_old():
+    '''
+    project1_old imports the api client, slow to import, so it is only
+    imported when needed and its stage is skipped if that fails
+    '''
+    try:
+        import project1_old
+    except Exception as error:
+        print(f'Skipping project1_old: {error}', file=sys.stderr)
+        return None
+    return project1_old
+
+
+def run(sizes):
+    '''
+    Times every stage for every size and mode
+    Output: dictionary with the environment and the timings
+    '''
+    timings = {}
+    for name, arguments in STARTUP_COMMANDS.items():
+        key = f'startup|{name}'
+        timings[key] = time_startup(arguments)
+        print(f'{key}: {timings[key]["median"] * 1000:.2f} ms',
+              file=sys.stderr)
+    for mode, body_words in MODES.items():
+        for n_docs in sizes:
+            results, feedback = generate_results(n_docs, body_words)
+            for stage, function in get_stages(results, feedback).items():
+                key = f'{stage}|{mode}|{n_docs}'
+                timings[key] = time_stage(
+                    function,
+                    OLD_REPEATS if stage.startswith('old_') else REPEATS)
+                print(f'{key}: {timings[key]["median"] * 1000:.2f} ms',
+                      file=sys.stderr)
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'timings': timings}
+
+
+def compare(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    '''
+    Lists the stages whose best time got slower than the tolerance allows
+    (the minimum is far less noisy than the median on a busy machine)
+    Input: two outputs of run, allowed slowdown as a fraction
+    Output: list of (stage, baseline seconds, new seconds, ratio)
+    '''
+    regressions = []
+    for key, timing in current['timings'].items():
+        if key not in baseline['timings']:
+            continue
+        before = baseline['timings'][key]['min']
+        ratio = timing['min'] / before if before else 1.0
+        if ratio > 1 + tolerance:
+            regressions.append((key, before, timing['min'], ratio))
+    return regressions
+
+
+def main():
+    '''
+    Main method
+    '''
+    if len(sys.argv) >= 3 and sys.argv[1] == 'run':
+        sizes = DEFAULT_SIZES
+        if len(sys.argv) > 3:
+            sizes = [int(size) for size in sys.argv[3].split(',')]
+        baseline = run(sizes)
+        with open(sys.argv[2], 'w') as output_file:
+            json.dump(baseline, output_file, indent=2)
+    elif len(sys.argv) >= 4 and sys.argv[1] == 'compare':
+        with open(sys.argv[2]) as baseline_file:
+            baseline = json.load(baseline_file)
+        with open(sys.argv[3]) as current_file:
+            current = json.load(current_file)
+        tolerance = (float(sys.argv[4]) if len(sys.argv) > 4
+                     else DEFAULT_TOLERANCE)
+        regressions = compare(baseline, current, tolerance)
+        for key, before, after, ratio in regressions:
+            print(f'REGRESSION {key}: {before * 1000:.2f} ms -> '
+                  + f'{after * 1000:.2f} ms ({ratio:.2f}x)')
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
+    else:
+        sys.exit("Format: benchmark.py run <Output JSON> [<Sizes>]\n"
+                 + "        benchmark.py compare <Baseline JSON> "
+                 + "<New JSON> [<Tolerance>]")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import json
+import mmap
+import os
+import sys
+from array import array
+from collections import Counter
+import numpy as np
+from document_store import INDEX_NAME, DocumentStore
+from stop_words import TOKEN_PATTERN
+
+'''
+Offline search backend: a BM25 ranked inverted index over a local corpus.
+Answers queries in the same shape as the Custom Search API, so the feedback
+loop can run without network access (see SEARCH_BACKEND in project1.py).
+
+Build an index with:
+    python3 bm25_index.py <corpus directory or .jsonl file> <index directory>
+The corpus can also be the page cache, indexing every page fetched so far.
+'''
+
+'''
+Fixed Values
+'''
+K1 = 1.2
+B = 0.75
+SNIPPET_LENGTH = 200  # characters of text kept as the result snippet
+
+
+def read_corpus(path):
+    '''
+    Yields documents as dicts with url, title and text.
+    A document store directory (e.g. the page cache, .page_cache) is read
+    page by page from its data file; any other directory is read file by
+    file; a .jsonl file needs one json object per line with url (or
+    formattedUrl), title and text (or body/snippet).
+    '''
+    if os.path.isfile(os.path.join(path, INDEX_NAME)):
+        store = DocumentStore(path)
+        for url in store.urls():
+            yield {'url': url, 'title': store.metadata(url).get('title', ''),
+                   'text': store.get(url)}
+        store.close()
+        return
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.abspath(os.path.join(root, name))
+                with open(file_path, encoding='utf-8',
+                          errors='ignore') as corpus_file:
+                    text = corpus_file.read()
+                yield {'url': 'file://' + file_path, 'title': name,
+                       'text': text}
+        return
+    with open(path, encoding='utf-8') as corpus_file:
+        for line in corpus_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield {'url': record.get('url', record.get('formattedUrl', '')),
+                   'title': record.get('title', ''),
+                   'text': record.get('text', record.get(
+                       'body', record.get('snippet', '')))}
+
+
+def build_index(corpus_path, index_dir):
+    '''
+    Indexes a corpus into index_dir.
+    Postings are grouped by term and stored as flat numpy arrays
+    (doc ids and term frequencies) that the searcher memory maps.
+    Input: corpus directory or jsonl file, output directory
+    Output: number of documents indexed
+    '''
+    os.makedirs(index_dir, exist_ok=True)
+    vocabulary = {}
+    term_ids, doc_ids, tfs = array('I'), array('I'), array('I')
+    doc_lengths, doc_offsets = array('I'), array('Q')
+
+    with open(os.path.join(index_dir, 'docs.jsonl'), 'wb') as docs_file:
+        for doc_id, document in enumerate(read_corpus(corpus_path)):
+            tokens = TOKEN_PATTERN.findall(
+                (document['title'] + ' ' + document['text']).lower())
+            for term, count in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc_id)
+                tfs.append(count)
+            doc_lengths.append(len(tokens))
+            doc_offsets.append(docs_file.tell())
+            snippet = ' '.join(document['text'].split())[:SNIPPET_LENGTH]
+            docs_file.write(json.dumps({
+                'formattedUrl': document['url'],
+                'title': document['title'],
+                'snippet': snippet}).encode('utf-8') + b'\n')
+
+    term_ids = np.frombuffer(term_ids, dtype=np.uint32)
+    # Stable sort keeps each posting list ordered by doc id
+    order = np.argsort(term_ids, kind='stable')
+    term_offsets = np.zeros(len(vocabulary) + 1, dtype=np.uint64)
+    np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)),
+              out=term_offsets[1:])
+    lengths = np.frombuffer(doc_lengths, dtype=np.uint32)
+
+    np.save(os.path.join(index_dir, 'postings_docs.npy'),
+            np.frombuffer(doc_ids, dtype=np.uint32)[order])
+    np.save(os.path.join(index_dir, 'postings_tfs.npy'),
+            np.frombuffer(tfs, dtype=np.uint32)[order])
+    np.save(os.path.join(index_dir, 'term_offsets.npy'), term_offsets)
+    np.save(os.path.join(index_dir, 'doc_lengths.npy'), lengths)
+    np.save(os.path.join(index_dir, 'doc_offsets.npy'),
+            np.frombuffer(doc_offsets, dtype=np.uint64))
+    with open(os.path.join(index_dir, 'terms.json'), 'w') as terms_file:
+        json.dump(list(vocabulary), terms_file)
+    with open(os.path.join(index_dir, 'meta.json'), 'w') as meta_file:
+        json.dump({'n_docs': len(lengths),
+                   'avg_length': float(lengths.mean()) if len(lengths)
+                   else 0.0}, meta_file)
+    return len(lengths)
+
+
+class BM25Index():
+    '''
+    Read only searcher over an index written by build_index.
+    Postings, lengths and document records are memory mapped, so opening
+    the index only loads the vocabulary.
+    '''
+
+    def __init__(self, index_dir, k1=K1, b=B):
+        self.k1 = k1
+        self.b = b
+        with open(os.path.join(index_dir, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        self.n_docs = meta['n_docs']
+        self.avg_length = meta['avg_length'] or 1.0
+        with open(os.path.join(index_dir, 'terms.json')) as terms_file:
+            self.vocabulary = {term: term_id for term_id, term
+                               in enumerate(json.load(terms_file))}
+
+        def load(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode='r')
+
+        self.postings_docs = load('postings_docs.npy')
+        self.postings_tfs = load('postings_tfs.npy')
+        self.term_offsets = load('term_offsets.npy')
+        self.doc_lengths = load('doc_lengths.npy')
+        self.doc_offsets = load('doc_offsets.npy')
+        with open(os.path.join(index_dir, 'docs.jsonl'), 'rb') as docs_file:
+            self.docs = mmap.mmap(docs_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+    def score(self, query):
+        '''
+        BM25 scores of every document matching at least one query term
+        Input: query string
+        Output: array of doc ids, array of their scores
+        '''
+        doc_parts, score_parts = [], []
+        for term in set(TOKEN_PATTERN.findall(query.lower())):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start = int(self.term_offsets[term_id])
+            end = int(self.term_offsets[term_id + 1])
+            docs = np.asarray(self.postings_docs[start:end])
+            tfs = np.asarray(self.postings_tfs[start:end], dtype=np.float64)
+            df = end - start
+            idf = np.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b
+                              * self.doc_lengths[docs] / self.avg_length)
+            doc_parts.append(docs)
+            score_parts.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+        if not doc_parts:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0)
+        if len(doc_parts) == 1:
+            return doc_parts[0], score_parts[0]
+        docs, inverse = np.unique(np.concatenate(doc_parts),
+                                  return_inverse=True)
+        return docs, np.bincount(inverse,
+                                 weights=np.concatenate(score_parts))
+
+    def document(self, doc_id):
+        start = int(self.doc_offsets[doc_id])
+        end = self.docs.find(b'\n', start)
+        return json.loads(self.docs[start:end])
+
+    def search(self, query, num=10, start=1):
+        '''
+        Top results for query, in the shape of a Custom Search response
+        Input: query, results per page, 1 based rank of the first result
+        Output: dictionary with the list of result items
+        '''
+        docs, scores = self.score(query)
+        depth = min(start - 1 + num, len(docs))
+        if depth < len(docs):
+            # Every document tied with the last one kept, so the pages of
+            # a query agree on the order
+            cutoff = -np.partition(-scores, depth - 1)[depth - 1]
+            top = np.flatnonzero(scores >= cutoff)
+        else:
+            top = np.arange(len(docs))
+        # Highest score first, lower doc id first on ties
+        top = top[np.lexsort((docs[top], -scores[top]))][
+            start - 1:start - 1 + num]
+        return {'items': [self.document(doc_id) for doc_id in docs[top]]}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('Format: bm25_index.py <corpus directory or .jsonl file> '
+                 + '<index directory>')
+    print(f'Indexed {build_index(sys.argv[1], sys.argv[2])} documents')
@@ -0,0 +1,186 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+import zlib
+
+'''
+Record and replay of everything a session gets from the network.
+In 'record' mode every api response and every fetched page body is
+appended to a single cassette file; in 'replay' mode searches and page
+fetches are answered from it only, so a recorded session can be re-run
+offline, deterministically, as a performance or quality benchmark.
+
+The file is a sequence of zlib compressed records followed by a json
+index (key -> [offset, length]) and a fixed size footer giving the
+index offset. Replay memory-maps the file and decompresses a record
+only when it is asked for. Recording into an existing cassette keeps
+its records and adds the new ones. A recording is written to a copy
+(<cassette>.recording) renamed over the cassette when it is closed, so
+a cassette stays readable if the recording process is killed.
+'''
+
+'''
+Fixed Values
+'''
+MAGIC = b'QXCASSETTE1'
+RECORDING_SUFFIX = '.recording'
+FOOTER = struct.Struct('<Q11s')  # index offset, magic
+COMPRESSION_LEVEL = 6
+
+
+def search_key(search_engine_id, query, start=1):
+    return f'search\t{search_engine_id}\t{start}\t{query}'
+
+
+def page_key(url):
+    return f'page\t{url}'
+
+
+class Cassette():
+    def __init__(self):
+        self.path = None
+        self.mode = None
+        self.__file = None
+        self.__map = None
+        self.__index = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def recording(self):
+        return self.mode == 'record'
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def configure(self, path=None, mode='replay'):
+        '''
+        Opens a cassette, nothing is recorded or replayed without a path
+        Input: cassette file, 'record' or 'replay'
+        '''
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'Unknown cassette mode: {mode}')
+        self.close()
+        if not path:
+            return
+        self.path = path
+        if mode == 'replay':
+            self.__file = open(path, 'rb')
+            self.__map = mmap.mmap(self.__file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+            _, self.__index = self.__read_index(self.__map)
+        else:
+            exists = os.path.exists(path) and os.path.getsize(path) > 0
+            if exists:
+                shutil.copyfile(path, path + RECORDING_SUFFIX)
+            self.__file = open(path + RECORDING_SUFFIX,
+                               'r+b' if exists else 'w+b')
+            if exists:
+                with mmap.mmap(self.__file.fileno(), 0,
+                               access=mmap.ACCESS_READ) as data:
+                    index_offset, self.__index = self.__read_index(data)
+                # New records overwrite the copy's index, rewritten on close
+                self.__file.seek(index_offset)
+                self.__file.truncate()
+        self.mode = mode
+
+    @staticmethod
+    def __read_index(data):
+        '''
+        Input: contents of a cassette file
+        Output: offset of the index, the index
+        '''
+        if len(data) < FOOTER.size:
+            raise ValueError('Not a cassette file')
+        index_offset, magic = FOOTER.unpack(data[-FOOTER.size:])
+        if magic != MAGIC:
+            raise ValueError('Not a cassette file, or recording was cut')
+        return index_offset, json.loads(
+            data[index_offset:-FOOTER.size].decode('utf-8'))
+
+    def __get(self, key):
+        entry = self.__index.get(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        if self.__map is None:
+            # Recording: earlier records are read back from the file
+            with self.__lock:
+                self.__file.seek(offset)
+                record = self.__file.read(length)
+                self.__file.seek(0, os.SEEK_END)
+        else:
+            record = self.__map[offset:offset + length]
+        return zlib.decompress(record).decode('utf-8')
+
+    def __put(self, key, text):
+        record = zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL)
+        with self.__lock:
+            offset = self.__file.tell()
+            self.__file.write(record)
+            self.__index[key] = [offset, len(record)]
+
+    def get_response(self, search_engine_id, query, start=1):
+        '''
+        Recorded api response, None if the search was never recorded
+        '''
+        response = self.__get(search_key(search_engine_id, query, start))
+        return None if response is None else json.loads(response)
+
+    def put_response(self, search_engine_id, query, response, start=1):
+        self.__put(search_key(search_engine_id, query, start),
+                   json.dumps(response, separators=(',', ':')))
+
+    def get_page(self, url):
+        '''
+        Recorded page text, None if the page was never recorded
+        '''
+        return self.__get(page_key(url))
+
+    def put_page(self, url, text):
+        self.__put(page_key(url), text)
+
+    def stats(self):
+        counts = {'search': 0, 'page': 0}
+        for key in self.__index:
+            counts[key.split('\t', 1)[0]] += 1
+        return {'searches': counts['search'], 'pages': counts['page'],
+                'bytes': sum(length for _, length in self.__index.values())}
+
+    def close(self):
+        '''
+        Writes the index of a recording and puts it in place of the
+        cassette, releases the file
+        '''
+        if self.__file is None:
+            return
+        if self.recording:
+            with self.__lock:
+                self.__file.seek(0, os.SEEK_END)
+                index_offset = self.__file.tell()
+                self.__file.write(json.dumps(
+                    self.__index, separators=(',', ':')).encode('utf-8'))
+                self.__file.write(FOOTER.pack(index_offset, MAGIC))
+        if self.__map is not None:
+            self.__map.close()
+        self.__file.close()
+        if self.recording:
+            os.replace(self.path + RECORDING_SUFFIX, self.path)
+        self.__file = self.__map = None
+        self.__index = {}
+        self.path = self.mode = None
+
+
+CASSETTE = Cassette()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit('Format: cassette.py <cassette file>')
+    CASSETTE.configure(sys.argv[1], 'replay')
+    print(json.dumps(CASSETTE.stats()))
+    CASSETTE.close()
@@ -0,0 +1,300 @@
+from collections import Counter
+import numpy as np
+import scipy.sparse as sp
+from positional_index import PositionalIndex
+from stop_words import ENGLISH_STOP_WORDS, TOKEN_PATTERN
+
+'''
+Fixed Values
+'''
+HASHING_FEATURES = 2 ** 18  # columns of the 'hashing' feature space
+
+
+class IncrementalCorpus():
+    '''
+    Tf-idf model of every result seen during a session.
+    Documents are added once, from the term counts each result caches, so
+    later rounds just grow the vocabulary and document frequencies.
+    Weights match TfidfVectorizer(analyzer='word', stop_words='english')
+    fitted on all the documents seen so far. The same pass records the
+    positions of the tokens (see positional_index.py).
+    '''
+
+    def __init__(self):
+        self.stop_words = ENGLISH_STOP_WORDS
+        self.vocabulary = {}  # term -> column
+        self.terms = []  # column -> term
+        self.__term_array = None
+        self.doc_index = {}  # url -> row
+        self.documents = []  # row -> FormattedResponse
+        self.relevance = np.zeros(0, dtype=np.int8)  # row -> 1, -1 or 0
+        self.__data = []
+        self.__indices = []
+        self.__indptr = [0]
+        self.__df = np.zeros(0, dtype=np.int64)
+        self.__tfidf_matrix = None
+        self.positions = PositionalIndex(self._token_columns)
+
+    def analyzer(self, text):
+        '''
+        Terms of a text, as TfidfVectorizer(stop_words='english') finds them
+        '''
+        return [term for term in TOKEN_PATTERN.findall(text.lower())
+                if term not in self.stop_words]
+
+    @property
+    def n_docs(self):
+        return len(self.documents)
+
+    @property
+    def n_terms(self):
+        return len(self.terms)
+
+    def _term_column(self, term, count):
+        '''
+        Column of a document term, growing the vocabulary if needed
+        '''
+        column = self.vocabulary.get(term)
+        if column is None:
+            column = len(self.terms)
+            self.vocabulary[term] = column
+            self.terms.append(term)
+        return column
+
+    def _token_columns(self, tokens):
+        '''
+        Columns of terms, -1 for stop words and unknown terms
+        '''
+        return [self.vocabulary.get(token, -1) for token in tokens]
+
+    def add_documents(self, documents):
+        '''
+        Analyzes results not seen in earlier rounds
+        Input: list of FormattedResponse
+        Output: nothing returned, corpus is updated in place
+        '''
+        new_columns = []
+        n_docs_before = self.n_docs
+        for document in documents:
+            row = self.doc_index.setdefault(document.url, len(self.documents))
+            # Near-duplicates share the row, and so the judgment, also the
+            # ones first found next to a result seen in an earlier round
+            for duplicate in document.duplicates:
+                self.doc_index.setdefault(duplicate.url, row)
+            if row < len(self.documents):
+                continue
+            self.documents.append(document)
+            # The result's cached term counts, so nothing is re-tokenized
+            column_counts = Counter()
+            term_columns = {}
+            for term, count in document.term_counts.items():
+                if term not in self.stop_words:
+                    term_columns[term] = self._term_column(term, count)
+                    column_counts[term_columns[term]] += count
+            self.__indices.extend(column_counts)
+            self.__data.extend(column_counts.values())
+            self.__indptr.append(len(self.__indices))
+            new_columns.extend(column_counts)
+            self.positions.add([term_columns.get(token, -1)
+                                for token in document.tokenized_text])
+        self.relevance = np.concatenate((
+            self.relevance,
+            np.zeros(self.n_docs - n_docs_before, dtype=np.int8)))
+        if not new_columns:
+            return
+        new_df = np.bincount(new_columns, minlength=self.n_terms)
+        new_df[:len(self.__df)] += self.__df
+        self.__df = new_df
+        self.__tfidf_matrix = None
+        self.__term_array = None
+
+    def add_judgments(self, relevance_feedback_dict, relevant_keyword,
+                      not_relevant_keyword):
+        '''
+        Stores the user's judgments, the latest one wins for repeated urls
+        Input: Dictionary with relevance feedback, keys of both lists
+        '''
+        for keyword, judgment in ((relevant_keyword, 1),
+                                  (not_relevant_keyword, -1)):
+            for document in relevance_feedback_dict[keyword]:
+                self.relevance[self.doc_index[document.url]] = judgment
+
+    def add_pseudo_judgments(self, documents):
+        '''
+        Marks results below the judged page as not relevant, unless the
+        user judged them in an earlier round
+        Input: list of FormattedResponse already in the corpus
+        '''
+        for document in documents:
+            row = self.doc_index[document.url]
+            if not self.relevance[row]:
+                self.relevance[row] = -1
+
+    def judgment_mask(self, relevant):
+        '''
+        0/1 vector over the rows marking documents judged relevant
+        (or not relevant when relevant is False)
+        '''
+        judgment = 1 if relevant else -1
+        return (self.relevance == judgment).astype(np.float64)
+
+    def idf(self):
+        '''
+        Smoothed idf, same formula as TfidfVectorizer
+        '''
+        return np.log((1 + self.n_docs) / (1 + self.__df)) + 1
+
+    def counts_matrix(self):
+        return sp.csr_matrix(
+            (np.asarray(self.__data, dtype=np.float64),
+             np.asarray(self.__indices, dtype=np.int64),
+             np.asarray(self.__indptr, dtype=np.int64)),
+            shape=(self.n_docs, self.n_terms))
+
+    def tfidf_matrix(self):
+        '''
+        L2 normalized tf-idf matrix of all documents, one row per document
+        '''
+        if self.__tfidf_matrix is None:
+            self.__tfidf_matrix = self.__weight(self.counts_matrix())
+        return self.__tfidf_matrix
+
+    def __weight(self, counts):
+        weighted = counts @ sp.diags(self.idf())
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)))
+        norms[norms == 0] = 1
+        return sp.csr_matrix(weighted.multiply(1 / norms))
+
+    def transform(self, text):
+        '''
+        Tf-idf vector of a text, terms outside the vocabulary are ignored
+        '''
+        column_counts = Counter()
+        for term in self.analyzer(text):
+            column = self._query_column(term)
+            if column is not None:
+                column_counts[column] += 1
+        counts = sp.csr_matrix(
+            (np.asarray(list(column_counts.values()), dtype=np.float64),
+             np.asarray(list(column_counts), dtype=np.int64),
+             [0, len(column_counts)]),
+            shape=(1, self.n_terms))
+        return self.__weight(counts)
+
+    def _query_column(self, term):
+        return self.vocabulary.get(term)
+
+    def document_frequencies(self):
+        return self.__df
+
+    def term_array(self):
+        '''
+        Vocabulary as a numpy array, indexable by columns
+        '''
+        if self.__term_array is None:
+            self.__term_array = self._build_term_array()
+        return self.__term_array
+
+    def _build_term_array(self):
+        return np.asarray(self.terms)
+
+    def terms_at(self, columns):
+        '''
+        Terms of the given columns, as a numpy string array
+        '''
+        return self.term_array()[columns].astype(str)
+
+    def inverse_transform(self, matrix):
+        '''
+        Terms of the non zero entries of each row, like TfidfVectorizer
+        '''
+        matrix = sp.csr_matrix(matrix)
+        return [self.terms_at(matrix[i, :].nonzero()[1])
+                for i in range(matrix.shape[0])]
+
+
+class HashingCorpus(IncrementalCorpus):
+    '''
+    Fixed memory variant of IncrementalCorpus using feature hashing.
+    Terms are hashed (murmurhash3) into n_features columns, so no
+    vocabulary dict is kept. To still turn columns back into words, each
+    column remembers one surface term: a majority vote over the term
+    occurrences hashed to it keeps the most frequent one.
+
+    Memory does not depend on the vocabulary: with m = n_features, the
+    document frequencies, vote counts, reverse map and its array (object
+    references, see term_array) take 32 * m bytes, plus at most m term
+    strings (m = 2 ** 18: 8 MB plus the strings), in addition to the
+    sparse per document counts and token positions every corpus keeps.
+    '''
+
+    def __init__(self, n_features=HASHING_FEATURES):
+        # Imported here, scikit-learn is slow to import and only this mode
+        # needs it
+        from sklearn.utils import murmurhash3_32
+        super().__init__()
+        self.hash = murmurhash3_32
+        self.n_features = n_features
+        self.bucket_terms = [None] * n_features  # column -> surface term
+        self.bucket_votes = np.zeros(n_features, dtype=np.int64)
+        self.term_occurrences = 0
+        self.colliding_occurrences = 0
+
+    @property
+    def n_terms(self):
+        return self.n_features
+
+    def _query_column(self, term):
+        column = self.hash(term, positive=True) % self.n_features
+        # Like the vocabulary, ignore columns no document has
+        if self.document_frequencies()[column:column + 1].any():
+            return column
+        return None
+
+    def _token_columns(self, tokens):
+        return [-1 if token in self.stop_words
+                else self.hash(token, positive=True) % self.n_features
+                for token in tokens]
+
+    def _term_column(self, term, count):
+        column = self.hash(term, positive=True) % self.n_features
+        self.term_occurrences += count
+        current = self.bucket_terms[column]
+        if current is None or current == term:
+            self.bucket_terms[column] = term
+            self.bucket_votes[column] += count
+            return column
+        # Another term already lives in the column
+        self.colliding_occurrences += count
+        self.bucket_votes[column] -= count
+        if self.bucket_votes[column] < 0:
+            self.bucket_terms[column] = term
+            self.bucket_votes[column] = -self.bucket_votes[column]
+        return column
+
+    def _build_term_array(self):
+        # References to the strings: a fixed width string array of all the
+        # columns would take m times the longest term
+        terms = np.empty(self.n_features, dtype=object)
+        terms[:] = [term or '' for term in self.bucket_terms]
+        return terms
+
+    def collision_stats(self):
+        '''
+        Output: dictionary with the used columns, the share of term
+                occurrences that landed on a column owned by another term,
+                the number of distinct terms estimated from the occupancy
+                (linear counting) and the expected share of those terms
+                sharing their column
+        '''
+        used = int((self.document_frequencies() > 0).sum())
+        m = self.n_features
+        distinct = -m * np.log(1 - min(used, m - 1) / m)
+        return {
+            'used_columns': used,
+            'occurrence_collision_rate':
+                self.colliding_occurrences / max(self.term_occurrences, 1),
+            'estimated_distinct_terms': float(distinct),
+            'expected_term_collision_rate':
+                float(1 - (1 - 1 / m) ** max(distinct - 1, 0)),
+        }
@@ -0,0 +1,98 @@
+import zlib
+import numpy as np
+
+'''
+Near-duplicate results (mirrors, syndicated copies) found with MinHash
+signatures of word shingles and an LSH index over bands of the
+signatures. Only results sharing a band are compared, and two results
+are duplicates when their signatures agree on at least DUPLICATE_THRESHOLD
+of the positions (an estimate of the Jaccard similarity of their
+shingles). Signatures are cached by url, as the same results come back
+round after round.
+'''
+
+'''
+Fixed Values
+'''
+SHINGLE_SIZE = 2  # words per shingle, snippets are short
+NUM_PERMUTATIONS = 64
+BANDS = 16  # of NUM_PERMUTATIONS / BANDS rows each
+DUPLICATE_THRESHOLD = 0.75
+MIN_SHINGLES = 5  # shorter texts are never taken for duplicates
+HASH_SEEDS = np.random.RandomState(6111).randint(
+    0, 1 << 64, size=(2, NUM_PERMUTATIONS), dtype=np.uint64) | np.uint64(1)
+
+
+def get_shingle_hashes(tokens, size=SHINGLE_SIZE):
+    '''
+    Input: tokens of a text, words per shingle
+    Output: array with the 32 bit hash of every distinct shingle
+    '''
+    shingles = {' '.join(tokens[i:i + size])
+                for i in range(len(tokens) - size + 1)}
+    return np.fromiter((zlib.crc32(shingle.encode('utf-8'))
+                        for shingle in shingles),
+                       dtype=np.uint64, count=len(shingles))
+
+
+def get_signature(tokens):
+    '''
+    MinHash signature: the minimum of each of NUM_PERMUTATIONS hash
+    functions over the shingles of the text. The functions are
+    multiply-shift hashes: the high 32 bits of a * x + b mod 2 ** 64
+    (uint64 arithmetic wraps around), with random odd a
+    Input: tokens of a text
+    Output: array of NUM_PERMUTATIONS values, None for too short texts
+    '''
+    hashes = get_shingle_hashes(tokens)
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    a, b = HASH_SEEDS
+    return ((hashes[:, None] * a + b) >> np.uint64(32)).min(axis=0)
+
+
+class DuplicateIndex():
+    def __init__(self, threshold=DUPLICATE_THRESHOLD, bands=BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.signatures = {}  # url -> signature, kept across rounds
+
+    def signature(self, result):
+        if result.url not in self.signatures:
+            self.signatures[result.url] = get_signature(
+                result.tokenized_text)
+        return self.signatures[result.url]
+
+    def is_duplicate(self, first, second):
+        return np.mean(first == second) >= self.threshold
+
+    def collapse(self, results):
+        '''
+        Groups near-duplicate results, each group is represented by its
+        best ranked result
+        Input: list of FormattedResponse in rank order
+        Output: list of the representatives in rank order, every one with
+                the other results of its group in its duplicates
+        '''
+        signatures = [self.signature(result) for result in results]
+        # LSH: results sharing one band of their signature are candidates
+        buckets = {}
+        groups = list(range(len(results)))  # result -> representative
+        for i, signature in enumerate(signatures):
+            if signature is None:
+                continue
+            for band in np.split(signature, self.bands):
+                key = band.tobytes()
+                for j in buckets.get(key, ()):
+                    if (groups[j] == j and groups[i] == i
+                            and self.is_duplicate(signatures[j], signature)):
+                        groups[i] = j
+                buckets.setdefault(key, []).append(i)
+        representatives = []
+        for i, result in enumerate(results):
+            if groups[i] == i:
+                result.duplicates = []
+                representatives.append(result)
+            else:
+                results[groups[i]].duplicates.append(result)
+        return representatives
@@ -0,0 +1,344 @@
+import fcntl
+import json
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+'''
+Append-only store of extracted page text, keyed by normalized url.
+Texts are appended to one data file and read back through mmap, so a
+lookup does not copy the page and the pages are never all in memory.
+Every change (new text, new metadata, deletion) is one json line
+appended to the index log; the last line of a url wins when the log is
+read back. Replaced and deleted texts stay in the data file until
+compaction, run in a background thread, copies the live texts to a new
+data file and switches the index log to it in one rename.
+
+Several processes can share a store (e.g. the page cache of sessions run
+in parallel). Every change takes an exclusive lock on the lock file and
+first reads the index lines other processes appended since; texts are
+written at the real end of the data file. A process that finds the index
+log replaced (another one compacted) reads it again from the start.
+
+Directory layout:
+    lock             locked (flock) while the store is changed
+    index.log        first line {"data": <data file>}, then one entry
+                     per line: {"url", "offset", "length", "meta"} or
+                     {"url", "deleted": true}
+    documents.N.dat  utf-8 texts, one after the other
+'''
+
+'''
+Fixed Values
+'''
+INDEX_NAME = 'index.log'
+LOCK_NAME = 'lock'
+COMPACTION_RATIO = 0.5  # share of dead bytes that triggers a compaction
+COMPACTION_MIN_BYTES = 16 * 1024 * 1024
+
+
+def normalize_url(url):
+    '''
+    Same key for urls differing only in case of scheme and host,
+    fragment or a trailing slash
+    '''
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path,
+                       parts.query, ''))
+
+
+class DocumentStore():
+    def __init__(self, directory):
+        self.directory = directory
+        self.__lock = threading.Lock()
+        self.__entries = {}  # normalized url -> (offset, length, meta)
+        self.__live_bytes = 0
+        self.__data_name = None
+        self.__data_file = None
+        self.__index_file = None
+        self.__index_read = 0  # bytes of the index log applied so far
+        self.__map = None
+        self.__compaction = None
+        os.makedirs(directory, exist_ok=True)
+        self.__lock_file = open(self.__path(LOCK_NAME), 'a')
+        with self.__lock, self.__locked():
+            self.__open()
+
+    def __path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def __locked(self, mode=fcntl.LOCK_EX):
+        '''
+        Lock shared with the other processes using the store, taken after
+        the thread lock
+        '''
+        fcntl.flock(self.__lock_file, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.__lock_file, fcntl.LOCK_UN)
+
+    def __open(self):
+        '''
+        Reads the index log back, creating an empty store if there is none
+        '''
+        index_path = self.__path(INDEX_NAME)
+        if not os.path.exists(index_path):
+            self.__write_index(INDEX_NAME, 'documents.0.dat', {})
+        self.__entries = {}
+        self.__live_bytes = 0
+        self.__index_read = 0
+        self.__map = None
+        self.__index_file = open(index_path, 'a+', encoding='utf-8')
+        self.__read_index_tail()
+        self.__data_file = open(self.__path(self.__data_name), 'a+b')
+
+    def __read_index_tail(self):
+        '''
+        Applies the complete index lines appended since the last read
+        '''
+        with open(self.__path(INDEX_NAME), 'rb') as index_file:
+            index_file.seek(self.__index_read)
+            for line in index_file:
+                if not line.endswith(b'\n'):
+                    break  # being written, or cut by a crash
+                self.__index_read += len(line)
+                entry = json.loads(line)
+                if 'data' in entry:
+                    self.__data_name = entry['data']
+                else:
+                    self.__apply(entry)
+
+    def __sync(self):
+        '''
+        Catches up with the changes of other processes, reopening the
+        store if one of them compacted it. Needs both locks.
+        '''
+        try:
+            replaced = (os.stat(self.__path(INDEX_NAME)).st_ino
+                        != os.fstat(self.__index_file.fileno()).st_ino)
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self.__data_file.close()
+            self.__index_file.close()
+            self.__open()
+        else:
+            self.__read_index_tail()
+
+    def __write_index(self, name, data_name, entries):
+        with open(self.__path(name), 'w', encoding='utf-8') as index_file:
+            index_file.write(json.dumps({'data': data_name}) + '\n')
+            for url, (offset, length, meta) in entries.items():
+                index_file.write(json.dumps({
+                    'url': url, 'offset': offset, 'length': length,
+                    'meta': meta}) + '\n')
+        open(self.__path(data_name), 'ab').close()
+
+    def __apply(self, entry):
+        old = self.__entries.pop(entry['url'], None)
+        if old is not None:
+            self.__live_bytes -= old[1]
+        if not entry.get('deleted'):
+            self.__entries[entry['url']] = (entry['offset'], entry['length'],
+                                            entry.get('meta', {}))
+            self.__live_bytes += entry['length']
+
+    def __log(self, entry):
+        self.__apply(entry)
+        self.__index_file.write(json.dumps(entry) + '\n')
+        self.__index_file.flush()
+        # Nobody else writes while the lock is held
+        self.__index_read = os.fstat(self.__index_file.fileno()).st_size
+
+    def __entry(self, url):
+        '''
+        Entry of a url, looking for it in what other processes stored if
+        it is not known here. Needs the thread lock.
+        '''
+        key = normalize_url(url)
+        if key not in self.__entries:
+            with self.__locked(fcntl.LOCK_SH):
+                self.__sync()
+        return self.__entries.get(key)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, url):
+        with self.__lock:
+            return self.__entry(url) is not None
+
+    def urls(self):
+        return list(self.__entries)
+
+    @property
+    def data_bytes(self):
+        return os.fstat(self.__data_file.fileno()).st_size
+
+    @property
+    def live_bytes(self):
+        return self.__live_bytes
+
+    def metadata(self, url):
+        '''
+        Metadata stored with the text, None if the url is not stored
+        '''
+        with self.__lock:
+            entry = self.__entry(url)
+        return None if entry is None else entry[2]
+
+    def size(self, url):
+        '''
+        Bytes of the stored text, 0 if the url is not stored
+        '''
+        with self.__lock:
+            entry = self.__entry(url)
+        return 0 if entry is None else entry[1]
+
+    def view(self, url):
+        '''
+        Input: page url
+        Output: memoryview over the stored utf-8 text, without copying,
+                or None if the url is not stored
+        '''
+        with self.__lock:
+            entry = self.__entry(url)
+            if entry is None:
+                return None
+            offset, length, _ = entry
+            if not length:
+                return memoryview(b'')
+            if self.__map is None or offset + length > len(self.__map):
+                # The data file grew since it was mapped. The open file is
+                # mapped, not the name: after another process compacted,
+                # it still holds the texts of the entries known here
+                self.__data_file.flush()
+                self.__map = mmap.mmap(self.__data_file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+            return memoryview(self.__map)[offset:offset + length]
+
+    def get(self, url):
+        '''
+        Input: page url
+        Output: stored text, None if the url is not stored
+        '''
+        data = self.view(url)
+        return None if data is None else str(data, 'utf-8')
+
+    def put(self, url, text, **meta):
+        '''
+        Appends the text of a page, replacing the one stored before
+        '''
+        data = text.encode('utf-8')
+        with self.__lock, self.__locked():
+            self.__sync()
+            offset = os.fstat(self.__data_file.fileno()).st_size
+            self.__data_file.write(data)
+            self.__data_file.flush()
+            self.__log({'url': normalize_url(url), 'offset': offset,
+                        'length': len(data), 'meta': meta})
+        self.maybe_compact()
+
+    def update(self, url, **meta):
+        '''
+        Changes the metadata of a stored page, its text is not rewritten
+        '''
+        key = normalize_url(url)
+        with self.__lock, self.__locked():
+            self.__sync()
+            if key not in self.__entries:
+                return
+            offset, length, old_meta = self.__entries[key]
+            self.__log({'url': key, 'offset': offset, 'length': length,
+                        'meta': dict(old_meta, **meta)})
+
+    def delete(self, url):
+        key = normalize_url(url)
+        with self.__lock, self.__locked():
+            self.__sync()
+            if key not in self.__entries:
+                return
+            self.__log({'url': key, 'deleted': True})
+        self.maybe_compact()
+
+    def maybe_compact(self):
+        '''
+        Starts a background compaction once enough of the data file is dead
+        '''
+        with self.__lock:
+            data_bytes = self.data_bytes
+            dead_bytes = data_bytes - self.__live_bytes
+            if (dead_bytes < COMPACTION_MIN_BYTES
+                    or dead_bytes < COMPACTION_RATIO * data_bytes):
+                return
+            if self.__compaction and self.__compaction.is_alive():
+                return
+            self.__compaction = threading.Thread(target=self.compact,
+                                                 daemon=True)
+            self.__compaction.start()
+
+    def compact(self):
+        '''
+        Copies the live texts to a new data file. Texts are appended, never
+        moved, so most of the copy happens without holding the locks; only
+        the pages written meanwhile are copied after taking them. If
+        another process compacted meanwhile, this copy is dropped.
+        '''
+        with self.__lock, self.__locked():
+            self.__sync()
+            snapshot = dict(self.__entries)
+            old_name = self.__data_name
+            old_file = open(self.__path(old_name), 'rb')
+        generation = int(old_name.split('.')[1]) + 1
+        new_name = f'documents.{generation}.{os.getpid()}.dat'
+        entries = {}
+        with old_file, open(self.__path(new_name), 'wb') as new_file:
+            def copy(key, entry):
+                offset, length, meta = entry
+                old_file.seek(offset)
+                entries[key] = (new_file.tell(), length, meta)
+                new_file.write(old_file.read(length))
+
+            for key, entry in snapshot.items():
+                copy(key, entry)
+            with self.__lock, self.__locked():
+                self.__sync()
+                if self.__data_name != old_name:
+                    new_file.close()
+                    os.remove(self.__path(new_name))
+                    return
+                for key, entry in self.__entries.items():
+                    if snapshot.get(key) is entry:
+                        continue
+                    if snapshot.get(key, ())[:2] == entry[:2]:
+                        # Only the metadata changed
+                        entries[key] = entries[key][:2] + entry[2:]
+                    else:
+                        copy(key, entry)
+                for key in set(entries) - set(self.__entries):
+                    del entries[key]
+                new_file.flush()
+                self.__write_index(INDEX_NAME + '.tmp', new_name, entries)
+                os.replace(self.__path(INDEX_NAME + '.tmp'),
+                           self.__path(INDEX_NAME))
+                # Views handed out earlier keep the old mapping alive
+                self.__data_file.close()
+                self.__index_file.close()
+                self.__open()
+                try:
+                    os.remove(self.__path(old_name))
+                except OSError:
+                    pass  # still mapped, where that can't be removed
+
+    def close(self):
+        if self.__compaction:
+            self.__compaction.join()
+        with self.__lock:
+            self.__data_file.close()
+            self.__index_file.close()
+            self.__lock_file.close()
@@ -0,0 +1,240 @@
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+from stop_words import TOKEN_PATTERN
+
+'''
+Expansion words from pretrained word vectors.
+The vectors are gensim KeyedVectors loaded with mmap='r', so they cost
+neither load time nor memory until pages of them are read. Neighbours of
+a query vector are found with an inverted file (IVF) index: the unit
+vectors are clustered with k-means, and a search only scores the words
+of the clusters closest to the query. The index is built once, next to
+the vectors (<vectors>.ivf), and memory mapped too.
+
+Index directory layout:
+    centroids.npy  n_lists x dim unit cluster centroids
+    offsets.npy    start of each cluster in ids / vectors (n_lists + 1)
+    ids.npy        word ids, grouped by cluster
+    vectors.npy    float32 unit vectors, in the order of ids
+    meta.json      sizes and build parameters
+
+Prepare vectors (word2vec text or binary format) with:
+    python3 embeddings.py <word2vec file> <vectors file> [--binary]
+'''
+
+'''
+Fixed Values
+'''
+N_PROBE = 16  # clusters scored per search
+TRAINING_SAMPLE = 100000  # vectors k-means is trained on
+KMEANS_ITERATIONS = 10
+CHUNK_SIZE = 65536  # vectors assigned to clusters at a time
+SEED = 6111
+OVERSAMPLING = 4  # neighbours searched per neighbour kept, some are skipped
+
+
+def load_keyed_vectors(path):
+    '''
+    Vectors saved with KeyedVectors.save, memory mapped. gensim is only
+    imported here, it is slow to import.
+    '''
+    from gensim.models import KeyedVectors
+    return KeyedVectors.load(path, mmap='r')
+
+
+def get_words(keyed_vectors):
+    '''
+    Word of each vector row (gensim 4 and 3 name it differently)
+    '''
+    if hasattr(keyed_vectors, 'index_to_key'):
+        return keyed_vectors.index_to_key
+    return keyed_vectors.index2word
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def train_centroids(vectors, n_lists, iterations=KMEANS_ITERATIONS):
+    '''
+    Spherical k-means on a sample of the vectors
+    Input: n x dim vectors (possibly memory mapped), number of clusters
+    Output: n_lists x dim unit centroids
+    '''
+    rng = np.random.RandomState(SEED)
+    sample_size = min(len(vectors), max(TRAINING_SAMPLE, n_lists))
+    sample = normalize_rows(vectors[np.sort(rng.choice(
+        len(vectors), sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = ~sums.any(axis=1)
+        # Clusters left empty restart from random vectors
+        sums[empty] = sample[rng.choice(sample_size, empty.sum())]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def build_ivf(vectors, index_dir, n_lists=None):
+    '''
+    Clusters the vectors and writes the index
+    Input: n x dim vectors, output directory, number of clusters
+           (about sqrt(n) if not given)
+    Output: number of vectors indexed
+    '''
+    os.makedirs(index_dir, exist_ok=True)
+    n_vectors, dim = vectors.shape
+    n_lists = n_lists or max(1, int(math.sqrt(n_vectors)))
+    centroids = train_centroids(vectors, n_lists)
+
+    assignment = np.empty(n_vectors, dtype=np.int32)
+    for start in range(0, n_vectors, CHUNK_SIZE):
+        chunk = normalize_rows(vectors[start:start + CHUNK_SIZE])
+        assignment[start:start + len(chunk)] = np.argmax(
+            chunk @ centroids.T, axis=1)
+    ids = np.argsort(assignment, kind='stable').astype(np.int64)
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+
+    # Unit vectors in cluster order, so a cluster is one contiguous read
+    unit_vectors = np.lib.format.open_memmap(
+        os.path.join(index_dir, 'vectors.npy'), mode='w+',
+        dtype=np.float32, shape=(n_vectors, dim))
+    for start in range(0, n_vectors, CHUNK_SIZE):
+        unit_vectors[start:start + CHUNK_SIZE] = normalize_rows(
+            vectors[ids[start:start + CHUNK_SIZE]])
+    unit_vectors.flush()
+    del unit_vectors
+
+    np.save(os.path.join(index_dir, 'centroids.npy'), centroids)
+    np.save(os.path.join(index_dir, 'offsets.npy'), offsets)
+    np.save(os.path.join(index_dir, 'ids.npy'), ids)
+    with open(os.path.join(index_dir, 'meta.json'), 'w') as meta_file:
+        json.dump({'n_vectors': n_vectors, 'dim': dim, 'n_lists': n_lists,
+                   'built': time.time()}, meta_file)
+    return n_vectors
+
+
+class IVFIndex():
+    '''
+    Approximate cosine nearest neighbours over a memory mapped index
+    '''
+
+    def __init__(self, index_dir):
+        self.centroids = np.load(os.path.join(index_dir, 'centroids.npy'))
+        self.offsets = np.load(os.path.join(index_dir, 'offsets.npy'))
+        self.ids = np.load(os.path.join(index_dir, 'ids.npy'), mmap_mode='r')
+        self.vectors = np.load(os.path.join(index_dir, 'vectors.npy'),
+                               mmap_mode='r')
+
+    def search(self, query, n=10, n_probe=N_PROBE):
+        '''
+        Input: query vector, number of neighbours, clusters to score
+        Output: array of word ids, array of their cosine similarities,
+                most similar first
+        '''
+        query = normalize_rows(query[None, :])[0]
+        n_probe = min(n_probe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query),
+                                n_probe - 1)[:n_probe]
+        ids, similarities = [], []
+        for cluster in lists:
+            start, end = self.offsets[cluster], self.offsets[cluster + 1]
+            ids.append(self.ids[start:end])
+            similarities.append(self.vectors[start:end] @ query)
+        ids, similarities = np.concatenate(ids), np.concatenate(similarities)
+        if len(similarities) > n:
+            top = np.argpartition(-similarities, n - 1)[:n]
+            ids, similarities = ids[top], similarities[top]
+        order = np.argsort(-similarities, kind='stable')
+        return ids[order], similarities[order]
+
+
+class WordEmbeddings():
+    '''
+    Memory mapped word vectors and their IVF index, built on first use
+    if it is not on disk yet
+    Input: file saved with KeyedVectors.save
+    '''
+
+    def __init__(self, path):
+        self.keyed_vectors = load_keyed_vectors(path)
+        self.words = get_words(self.keyed_vectors)
+        index_dir = path + '.ivf'
+        if not os.path.exists(os.path.join(index_dir, 'meta.json')):
+            build_ivf(self.keyed_vectors.vectors, index_dir)
+        self.index = IVFIndex(index_dir)
+
+    def __contains__(self, word):
+        return word in self.keyed_vectors
+
+    def centroid(self, weighted_words):
+        '''
+        Weighted sum of the unit vectors of the known words
+        Input: list of (word, weight)
+        Output: vector, None if no word is known
+        '''
+        known = [(word, weight) for word, weight in weighted_words
+                 if weight > 0 and word in self.keyed_vectors]
+        if not known:
+            return None
+        vectors = normalize_rows(np.vstack(
+            [self.keyed_vectors[word] for word, _ in known]))
+        weights = np.array([weight for _, weight in known], dtype=np.float32)
+        return weights @ vectors
+
+    def neighbours(self, vector, n=10):
+        '''
+        Nearest words that could be query words: lowercase, one token
+        (vectors of phrases and capitalized forms are skipped)
+        Input: query vector, number of words
+        Output: list of (word, cosine similarity), most similar first
+        '''
+        ids, similarities = self.index.search(vector, n * OVERSAMPLING)
+        neighbours = []
+        for i, similarity in zip(ids, similarities):
+            word = self.words[i]
+            if word.islower() and TOKEN_PATTERN.fullmatch(word):
+                neighbours.append((word, float(similarity)))
+        return neighbours[:n]
+
+    def similarities(self, vector, words):
+        '''
+        Input: query vector, list of words
+        Output: dictionary of word -> cosine similarity, for known words
+        '''
+        known = [word for word in words if word in self.keyed_vectors]
+        if not known:
+            return {}
+        vectors = normalize_rows(np.vstack(
+            [self.keyed_vectors[word] for word in known]))
+        similarities = vectors @ normalize_rows(vector[None, :])[0]
+        return dict(zip(known, similarities.tolist()))
+
+
+def main():
+    '''
+    Converts word2vec vectors to a memory mappable file and indexes them
+    '''
+    if len(sys.argv) not in (3, 4):
+        sys.exit('Format: embeddings.py <word2vec file> <vectors file> '
+                 + '[--binary]')
+    from gensim.models import KeyedVectors
+    keyed_vectors = KeyedVectors.load_word2vec_format(
+        sys.argv[1], binary=sys.argv[3:] == ['--binary'])
+    keyed_vectors.save(sys.argv[2])
+    WordEmbeddings(sys.argv[2])
+    print(f'Indexed {len(get_words(keyed_vectors))} words')
+
+
+if __name__ == '__main__':
+    main()
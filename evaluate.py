@@ -0,0 +1,124 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import project1
+from cassette import CASSETTE
+
+'''
+Non-interactive evaluation of the feedback loop.
+Runs one session per query with a simulated judge answering from qrels,
+many sessions at once in a process pool, and prints one json line per
+query with precision@10 per round, rounds to convergence and per-phase
+latency, followed by a summary line.
+
+The queries file has one json object per line:
+    {"query": "per se", "precision": 0.9, "relevant": ["<url>", ...]}
+'''
+
+'''
+Fixed Values
+'''
+DEFAULT_WORKERS = 4
+
+
+class SimulatedJudge():
+    '''
+    Answers the Y/N prompt from a set of relevant urls (the qrels)
+    '''
+
+    def __init__(self, relevant_urls):
+        self.relevant_urls = {self.normalize(url) for url in relevant_urls}
+
+    @staticmethod
+    def normalize(url):
+        return url.strip().rstrip('/').lower()
+
+    def __call__(self, result):
+        return self.normalize(result.url) in self.relevant_urls
+
+
+def read_queries(path):
+    with open(path, encoding='utf-8') as queries_file:
+        return [json.loads(line) for line in queries_file if line.strip()]
+
+
+def evaluate_query(json_api_key, search_engine_id, query, search_backend=None):
+    '''
+    Runs a full session for one query, silencing the terminal output
+    Input: API key, search engine id, query entry of the queries file,
+           optional offline index directory or cassette file to replay
+    Output: dictionary with the per round results of the session
+    '''
+    if search_backend and os.path.isfile(search_backend):
+        if CASSETTE.path != search_backend:
+            CASSETTE.configure(search_backend, 'replay')
+    elif search_backend:
+        project1.SEARCH_BACKEND = search_backend
+    judge = SimulatedJudge(query.get('relevant', []))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        rounds = project1.run_session(json_api_key, search_engine_id,
+                                      query['query'], query['precision'],
+                                      judge)
+    return {
+        'query': query['query'],
+        'target_precision': query['precision'],
+        'precision_per_round': [entry['precision'] for entry in rounds],
+        'iterations': len(rounds),
+        'converged': rounds[-1]['precision'] >= query['precision'],
+        'total_time': time.perf_counter() - start,
+        'rounds': rounds,
+    }
+
+
+def summarize(evaluations):
+    '''
+    Aggregates the sessions of a run
+    '''
+    converged = [entry for entry in evaluations if entry['converged']]
+    phases = {}
+    for phase in ('search_time', 'feedback_time', 'expansion_time'):
+        times = [entry[phase] for evaluation in evaluations
+                 for entry in evaluation['rounds']]
+        phases[phase] = sum(times) / max(len(times), 1)
+    return {
+        'queries': len(evaluations),
+        'converged': len(converged),
+        'mean_iterations_to_convergence':
+            sum(entry['iterations'] for entry in converged)
+            / max(len(converged), 1),
+        'mean_phase_time_per_round': phases,
+    }
+
+
+def main():
+    '''
+    Main method
+    '''
+    if len(sys.argv) not in (4, 5, 6):
+        sys.exit("Format: evaluate.py <Google API Key> "
+                 + "<Google Search Engine ID> <Queries JSONL> "
+                 + "[<Workers>] [<Offline Index or Cassette>]")
+    json_api_key, search_engine_id = sys.argv[1], sys.argv[2]
+    queries = read_queries(sys.argv[3])
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_WORKERS
+    search_backend = sys.argv[5] if len(sys.argv) > 5 else None
+
+    evaluations = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(evaluate_query, json_api_key,
+                                   search_engine_id, query, search_backend)
+                   for query in queries]
+        for future in futures:
+            evaluation = future.result()
+            evaluations.append(evaluation)
+            print(json.dumps(evaluation))
+    print(json.dumps({'summary': summarize(evaluations)}))
+
+
+if __name__ == '__main__':
+    main()
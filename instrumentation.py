@@ -0,0 +1,126 @@
+import contextlib
+import json
+import threading
+import time
+from collections import defaultdict
+
+'''
+Timing and counters for the feedback loop.
+When enabled, every span (a timed phase of an iteration) is written as a
+json line to the trace file, and totals are written to a metrics file in
+Prometheus text format when the tracer is closed. When disabled (the
+default) spans are a shared no-op context manager.
+'''
+
+'''
+Fixed Values
+'''
+METRIC_PREFIX = 'query_expansion'
+NULL_SPAN = contextlib.nullcontext()
+
+
+class Span():
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record_span(self, time.perf_counter() - self.start)
+        return False
+
+
+class Tracer():
+    def __init__(self):
+        self.enabled = False
+        self.iteration = None
+        self.trace_file = None
+        self.metrics_path = None
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.span_counts = defaultdict(int)
+        self.span_seconds = defaultdict(float)
+        self.__lock = threading.Lock()
+
+    def configure(self, trace_path=None, metrics_path=None):
+        '''
+        Enables the tracer if any output path is given
+        Input: json lines trace file, Prometheus metrics file
+        '''
+        self.close()
+        self.metrics_path = metrics_path
+        if trace_path:
+            self.trace_file = open(trace_path, 'a', encoding='utf-8')
+        self.enabled = bool(trace_path or metrics_path)
+
+    def span(self, name, **attributes):
+        '''
+        Context manager timing one phase, e.g.
+            with TRACER.span('rocchio'):
+                ...
+        '''
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attributes)
+
+    def record_span(self, span, duration):
+        with self.__lock:
+            self.span_counts[span.name] += 1
+            self.span_seconds[span.name] += duration
+            if self.trace_file:
+                entry = {'span': span.name, 'timestamp': span.timestamp,
+                         'duration': duration, 'iteration': self.iteration}
+                entry.update(span.attributes)
+                self.trace_file.write(json.dumps(entry) + '\n')
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.counters[name] += value
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.gauges[name] = value
+
+    def metrics_text(self):
+        '''
+        Current totals in Prometheus text exposition format
+        '''
+        lines = [f'# TYPE {METRIC_PREFIX}_span_seconds_total counter']
+        for name, seconds in sorted(self.span_seconds.items()):
+            lines.append(f'{METRIC_PREFIX}_span_seconds_total'
+                         + f'{{span="{name}"}} {seconds}')
+        lines.append(f'# TYPE {METRIC_PREFIX}_spans_total counter')
+        for name, count in sorted(self.span_counts.items()):
+            lines.append(f'{METRIC_PREFIX}_spans_total'
+                         + f'{{span="{name}"}} {count}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name}_total counter')
+            lines.append(f'{METRIC_PREFIX}_{name}_total {value}')
+        for name, value in sorted(self.gauges.items()):
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} gauge')
+            lines.append(f'{METRIC_PREFIX}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        '''
+        Flushes the trace and writes the metrics file
+        '''
+        with self.__lock:
+            if self.trace_file:
+                self.trace_file.close()
+                self.trace_file = None
+            if self.metrics_path:
+                with open(self.metrics_path, 'w') as metrics_file:
+                    metrics_file.write(self.metrics_text())
+
+
+TRACER = Tracer()
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from document_store import DocumentStore, normalize_url
+
+'''
+Fixed Values
+'''
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '.page_cache')
+CACHE_TTL = 24 * 60 * 60  # seconds before a page must be revalidated
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+class CachedPage():
+    def __init__(self, url, text, stored, etag=None, last_modified=None):
+        self.url = url
+        self.text = text
+        self.stored = stored
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def is_fresh(self, ttl):
+        return time.time() - self.stored < ttl
+
+    @property
+    def conditional_headers(self):
+        '''
+        Headers turning the next request for the page into a revalidation
+        '''
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class PageCache():
+    '''
+    Disk backed cache of the text extracted from result pages, keyed by url.
+    Pages live in a DocumentStore (one append-only file read through mmap),
+    with the time they were stored and their validators as metadata, so a
+    hit reads the page without copying the file, and a revalidation only
+    appends a line to the index. Pages are evicted least recently used
+    first once the cache grows past max_bytes.
+    '''
+
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL,
+                 max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__store = None
+        self.__entries = None  # normalized url -> size, least recent first
+        self.__size = 0
+
+    @property
+    def store(self):
+        '''
+        The DocumentStore, opened on first use, ordering pages by storage
+        time as the least recently used order
+        '''
+        with self.__lock:
+            if self.__store is None:
+                store = DocumentStore(self.directory)
+                pages = sorted(store.urls(),
+                               key=lambda url: store.metadata(url)['stored'])
+                self.__entries = OrderedDict(
+                    (url, store.size(url)) for url in pages)
+                self.__size = sum(self.__entries.values())
+                self.__store = store
+            return self.__store
+
+    def get(self, url):
+        '''
+        Input: page url
+        Output: CachedPage (possibly stale) or None if the url is not cached
+        '''
+        store = self.store
+        meta = store.metadata(url)
+        text = store.get(url)
+        if meta is None or text is None:
+            return None
+        with self.__lock:
+            key = normalize_url(url)
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+        return CachedPage(url, text, meta['stored'],
+                          meta.get('etag'), meta.get('last_modified'))
+
+    def put(self, url, text, etag=None, last_modified=None, **meta):
+        '''
+        Stores the extracted text of a page, evicting old pages if needed.
+        Extra metadata (e.g. the title) is kept with the page
+        '''
+        store = self.store
+        store.put(url, text, stored=time.time(), etag=etag,
+                  last_modified=last_modified, **meta)
+        evicted = []
+        with self.__lock:
+            key = normalize_url(url)
+            self.__size -= self.__entries.pop(key, 0)
+            self.__entries[key] = store.size(url)
+            self.__size += self.__entries[key]
+            while self.__size > self.max_bytes and len(self.__entries) > 1:
+                evicted_url, evicted_size = self.__entries.popitem(last=False)
+                self.__size -= evicted_size
+                evicted.append(evicted_url)
+        for evicted_url in evicted:
+            store.delete(evicted_url)
+
+    def refresh(self, page):
+        '''
+        Marks a stale page as fresh again after a 304 Not Modified
+        '''
+        self.store.update(page.url, stored=time.time())
+
+    def record(self, outcome):
+        '''
+        Counts a lookup outcome: 'hits', 'revalidations' or 'misses'
+        '''
+        with self.__lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    @property
+    def hit_rate(self):
+        '''
+        Share of lookups answered without downloading the page again
+        '''
+        lookups = self.hits + self.revalidations + self.misses
+        if not lookups:
+            return 0.0
+        return (self.hits + self.revalidations) / lookups
+
+    def stats(self):
+        return {'hits': self.hits, 'revalidations': self.revalidations,
+                'misses': self.misses, 'hit_rate': self.hit_rate}
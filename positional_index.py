@@ -0,0 +1,143 @@
+import numpy as np
+
+'''
+Positions of the terms of every result of a session. Each result is
+walked once, when the corpus first sees it, and kept as the array of the
+corpus columns of its tokens, in text order (-1 for stop words, so words
+they separate are not taken for neighbours). Bigrams and co-occurrences
+with the query are counted from those arrays with a few vectorized
+operations over the rows asked for, never by reading the texts again.
+Results are only ever appended, so the index grows across rounds and
+stays linear in the total number of tokens.
+'''
+
+'''
+Fixed Values
+'''
+WINDOW = 5  # positions on each side of a query term counted as near it
+PHRASE_MIN_COUNT = 2  # adjacent occurrences making two words a phrase
+
+
+class PositionalIndex():
+    '''
+    Input: function giving the columns of a list of terms, -1 for the
+           ones that have none
+    '''
+
+    def __init__(self, token_columns):
+        self.token_columns = token_columns
+        self.positions = []  # row -> array of columns, in text order
+
+    def add(self, columns):
+        '''
+        Appends the next row
+        Input: columns of the tokens of a result, in text order
+        '''
+        self.positions.append(np.array(columns, dtype=np.int64))
+
+    def columns(self, terms):
+        return np.array(self.token_columns(terms), dtype=np.int64)
+
+    def join(self, rows, gap):
+        '''
+        Positions of the rows one after the other, gap -1 entries apart,
+        so no bigram or window spans two rows
+        '''
+        separator = np.full(gap, -1, dtype=np.int64)
+        parts = []
+        for row in rows:
+            parts.append(self.positions[row])
+            parts.append(separator)
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+    def bigram_counts(self, rows, terms):
+        '''
+        Adjacent occurrences of every ordered pair of the given terms
+        Input: rows to count in, terms
+        Output: dictionary of (first term, second term) -> count
+        '''
+        columns = self.columns(terms)
+        known = columns[columns >= 0]
+        positions = self.join(rows, 1)
+        first, second = positions[:-1], positions[1:]
+        pairs = np.isin(first, known) & np.isin(second, known)
+        found, found_counts = np.unique(
+            np.vstack((first[pairs], second[pairs])), axis=1,
+            return_counts=True)
+        counts = dict(zip(zip(*found.tolist()), found_counts.tolist()))
+        return {(a, b): counts[column_a, column_b]
+                for a, column_a in zip(terms, columns.tolist())
+                for b, column_b in zip(terms, columns.tolist())
+                if (column_a, column_b) in counts}
+
+    def cooccurrence_counts(self, rows, query_terms, terms, window=WINDOW):
+        '''
+        Occurrences of each term within window positions of a query term
+        Input: rows to count in, query terms, terms to count
+        Output: array of counts, one per term
+        '''
+        query_columns = self.columns(query_terms)
+        columns = self.columns(terms)
+        positions = self.join(rows, window)
+        hits = np.isin(positions, query_columns[query_columns >= 0])
+        # Query terms in [i - window, i + window], from prefix sums
+        prefix = np.concatenate(([0], np.cumsum(hits)))
+        index = np.arange(len(positions))
+        near = (prefix[np.minimum(index + window + 1, len(positions))]
+                - prefix[np.maximum(index - window, 0)]) > 0
+        values, value_counts = np.unique(
+            positions[near & ~hits & (positions >= 0)], return_counts=True)
+        if not len(values):
+            return np.zeros(len(terms), dtype=np.int64)
+        found = np.minimum(np.searchsorted(values, columns), len(values) - 1)
+        return np.where(values[found] == columns, value_counts[found], 0)
+
+    def order_query(self, query, words, rows):
+        '''
+        Places the expansion words next to the words they form a phrase
+        with in the given rows (e.g. the relevant results), the others at
+        the end, the ones found closest to the query first. The words of
+        the query keep their order.
+        Input: query, expansion words, rows
+        Output: augmented query
+        '''
+        query_terms = query.split()
+        if not query_terms:
+            return ' '.join(words)
+        lowered = [term.lower() for term in query_terms]
+        bigrams = self.bigram_counts(rows, lowered + words)
+        proximity = dict(zip(words, self.cooccurrence_counts(
+            rows, lowered, words)))
+
+        # Chunks are phrases: query words that are one start together, and
+        # a word only joins the start or end of a chunk, never splits it
+        chunks = [[query_terms[0]]]
+        for previous, term, query_term in zip(lowered, lowered[1:],
+                                              query_terms[1:]):
+            if bigrams.get((previous, term), 0) >= PHRASE_MIN_COUNT:
+                chunks[-1].append(query_term)
+            else:
+                chunks.append([query_term])
+        n_query_chunks = len(chunks)
+        for word in words:
+            count, target, before = max(
+                ((bigrams.get(pair, 0), i, before)
+                 for i, chunk in enumerate(chunks)
+                 for before, pair in (
+                     (False, (chunk[-1].lower(), word)),
+                     (True, (word, chunk[0].lower())))),
+                key=lambda option: option[0])
+            if count < PHRASE_MIN_COUNT:
+                chunks.append([word])
+            elif before:
+                chunks[target].insert(0, word)
+            else:
+                chunks[target].append(word)
+
+        # Chunks of new words only go last, the closest to the query first
+        chunks[n_query_chunks:] = sorted(
+            chunks[n_query_chunks:],
+            key=lambda chunk: -max(proximity[word] for word in chunk))
+        return ' '.join(term for chunk in chunks for term in chunk)
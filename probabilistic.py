@@ -0,0 +1,63 @@
+import numpy as np
+import scipy.sparse as sp
+
+'''
+Probabilistic (binary independence model) query expansion.
+Terms are weighted with the Robertson/Sparck-Jones relevance weight
+
+    c_t = log( ((s + 0.5) / (S - s + 0.5))
+               / ((df_t - s + 0.5) / (N - df_t - S + s + 0.5)) )
+
+where N is the number of judged documents, S the number of relevant ones,
+df_t the documents containing t and s the relevant documents containing t.
+'''
+
+
+def compute_term_weights(incidence, relevant_mask):
+    '''
+    c_t of every term from column sums of the incidence matrix
+    Input: incidence matrix of judged documents, 0/1 mask of relevant rows
+    Output: array of c_t, one per column
+    '''
+    N = incidence.shape[0]
+    S = relevant_mask.sum()
+    s = incidence.T @ relevant_mask
+    df_t = np.asarray(incidence.sum(axis=0)).ravel()
+    return np.log(((s + 0.5) / (S - s + 0.5))
+                  / ((df_t - s + 0.5) / (N - df_t - S + s + 0.5)))
+
+
+def compute_term_ranks(incidence, relevant_mask, result_ranks):
+    '''
+    Rank of the last relevant document containing each term,
+    used to break c_t ties (0 if no relevant document has the term)
+    '''
+    relevant_rows = np.flatnonzero(relevant_mask)
+    if not len(relevant_rows):
+        return np.zeros(incidence.shape[1])
+    # Position (1 based) of the latest relevant document with the term
+    positions = sp.diags(np.arange(1.0, len(relevant_rows) + 1)) @ \
+        incidence[relevant_rows]
+    last = np.asarray(positions.max(axis=0).todense()).ravel().astype(int)
+    doc_ranks = np.maximum(1, np.asarray(result_ranks)[relevant_rows])
+    return np.where(last > 0, doc_ranks[last - 1], 0)
+
+
+def get_bim_words(input_query, incidence, terms, relevant_mask,
+                  result_ranks, k=2):
+    '''
+    Best expansion words under the binary independence model
+    Input: Query, 0/1 incidence matrix of the judged documents (documents
+           x terms), array of its terms, 0/1 mask of the relevant rows,
+           rank of each document, number of words
+    Output: list of (word, c_t) pairs, reverse sorted based on c_t
+    '''
+    if not len(terms):
+        return []
+    weights = compute_term_weights(incidence, relevant_mask)
+    ranks = compute_term_ranks(incidence, relevant_mask, result_ranks)
+
+    keep = np.char.find(input_query, terms) < 0
+    terms, weights, ranks = terms[keep], weights[keep], ranks[keep]
+    order = np.lexsort((terms, ranks, -weights))[:k]
+    return [(str(terms[i]), float(weights[i])) for i in order]
@@ -1,7 +1,22 @@
+import json
 import sys
-from googleapiclient.discovery import build
-from sklearn.feature_extraction.text import TfidfVectorizer
-from HttpResponse import FormattedResponse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from bm25_index import BM25Index
+from cassette import CASSETTE
+from corpus import HashingCorpus, IncrementalCorpus
+from dedup import DuplicateIndex
+from probabilistic import get_bim_words
+from HttpResponse import FormattedResponse, fetch_full_text
+from instrumentation import TRACER
+from mock_response import MOCK_RESPONSE
+from result_cache import ResultCache
+from scheduler import SCHEDULER
+from speculation import SpeculativeRound
+from stop_words import ENGLISH_STOP_WORDS
 
 
 '''
@@ -14,31 +29,225 @@ JSON_API_KEY = ''
 MAX_ATTEMPTS = 10
 USE_FULL_TEXT = False
 USE_MOCK = False
+USE_RESULT_CACHE = True
+RESULT_CACHE_FILE = None  # e.g. '.result_cache.json' to keep results on disk
+API_TIMEOUT = 10  # seconds
+SEARCH_BACKEND = None  # directory of a bm25_index.py index to search offline
+CASSETTE_FILE = None  # e.g. 'session.cassette' to record or replay sessions
+CASSETTE_MODE = 'replay'  # or 'record' to save every response and page
+RESULTS_PER_PAGE = 10  # results judged by the user, one api page
+RESULT_DEPTH = 10  # results fetched per round, e.g. 30 or 50 (10 per call)
+USE_DEDUPLICATION = True  # show, fetch and index near-duplicates only once
+TRACE_FILE = None  # e.g. 'trace.jsonl' to record timed spans per phase
+SESSION_LOG = None  # e.g. 'sessions.jsonl' to save sessions for sweep.py
+METRICS_FILE = None  # e.g. 'metrics.prom' for Prometheus text metrics
+USE_SPECULATION = True  # index and expand while the user is judging
+SPECULATIVE_SEARCH = False  # also search both possible next queries
 
 ALPHA = 1
 BETA = 0.75
 GAMMA = 0.15
+EXPANSION_SIZE = 2  # words added to the query per iteration
+EXPANSION_METHOD = 'rocchio'  # or 'bim' for probabilistic term weighting
+EMBEDDINGS_FILE = None  # e.g. 'vectors.kv' (see embeddings.py) to also
+#                         expand with word vector neighbours
+EMBEDDING_WEIGHT = 0.5  # share of a word's score given by its similarity
+EMBEDDING_NEIGHBOURS = 20  # neighbours of the Rocchio centroid considered
+CENTROID_WORDS = 10  # best Rocchio words the centroid is made of
+USE_QUERY_ORDERING = True  # place new words by the phrases they form
+VECTORIZER_MODE = 'tfidf'  # or 'hashing' (corpus.HASHING_FEATURES columns)
+
+SEARCH_SERVICES = {}
+OFFLINE_INDEXES = {}
+WORD_EMBEDDINGS = {}
+RESULT_CACHE = ResultCache(RESULT_CACHE_FILE)
+SHARED_OBJECTS_LOCK = threading.Lock()
+THREAD_STATE = threading.local()
+BACKGROUND = ThreadPoolExecutor(max_workers=4)
+PAGE_EXECUTOR = ThreadPoolExecutor(max_workers=5)
+
+
+def new_corpus():
+    '''
+    Empty corpus for a session, in the configured VECTORIZER_MODE
+    '''
+    if VECTORIZER_MODE == 'hashing':
+        return HashingCorpus()
+    return IncrementalCorpus()
+
+
+def get_http():
+    '''
+    Keep-alive connection of the calling thread, as httplib2 connections
+    can't be shared between threads
+    '''
+    if not hasattr(THREAD_STATE, 'http'):
+        # Imported on first use, offline and replayed sessions never do
+        import httplib2
+        THREAD_STATE.http = httplib2.Http(timeout=API_TIMEOUT)
+    return THREAD_STATE.http
 
 
-def get_google_results(json_api_key,
-                       search_engine_id, query, mock_response=USE_MOCK):
+def get_search_service(json_api_key):
+    '''
+    Builds the Custom Search client once per api key and reuses it,
+    so discovery runs once and the keep-alive connection is kept open
+    Input: json api key
+    Output: Custom Search service object
+    '''
+    with SHARED_OBJECTS_LOCK:
+        if json_api_key not in SEARCH_SERVICES:
+            from googleapiclient.discovery import build
+            SEARCH_SERVICES[json_api_key] = build(
+                "customsearch", "v1", developerKey=json_api_key,
+                http=get_http(), cache_discovery=False)
+        return SEARCH_SERVICES[json_api_key]
+
+
+def get_offline_index(index_dir):
+    '''
+    Opens the offline BM25 index once and reuses it
+    '''
+    with SHARED_OBJECTS_LOCK:
+        if index_dir not in OFFLINE_INDEXES:
+            OFFLINE_INDEXES[index_dir] = BM25Index(index_dir)
+        return OFFLINE_INDEXES[index_dir]
+
+
+def get_word_embeddings(path):
+    '''
+    Loads the memory mapped word vectors once and reuses them
+    '''
+    with SHARED_OBJECTS_LOCK:
+        if path not in WORD_EMBEDDINGS:
+            from embeddings import WordEmbeddings
+            WORD_EMBEDDINGS[path] = WordEmbeddings(path)
+        return WORD_EMBEDDINGS[path]
+
+
+def search(json_api_key, search_engine_id, query, start=1):
+    '''
+    Searches, recording the response or replaying it when a cassette is
+    configured
+    Input: json api key, search engine id, query, rank of the first result
+    Output: raw api response
+    '''
+    if CASSETTE.replaying:
+        res = CASSETTE.get_response(search_engine_id, query, start)
+        if res is None:
+            print(f'Search not in cassette: {query}')
+        return res or {'items': []}
+    res = query_backend(json_api_key, search_engine_id, query, start)
+    if CASSETTE.recording:
+        CASSETTE.put_response(search_engine_id, query, res, start)
+    return res
+
+
+def query_backend(json_api_key, search_engine_id, query, start=1):
+    '''
+    Calls the json api, answering repeated queries from the result cache.
+    When SEARCH_BACKEND is set, the local BM25 index answers instead.
+    Input: json api key, search engine id, query, rank of the first result
+    Output: raw api response
+    '''
+    if SEARCH_BACKEND:
+        return get_offline_index(SEARCH_BACKEND).search(query, start=start)
+    if USE_RESULT_CACHE:
+        res = RESULT_CACHE.get(search_engine_id, query, start=start)
+        if res is not None:
+            return res
+    service = get_search_service(json_api_key)
+    parameters = {'q': query, 'cx': search_engine_id}
+    if start != 1:
+        parameters['start'] = start
+    try:
+        # Rate limited and retried, shared with the page fetches
+        res = SCHEDULER.call('customsearch', lambda: service.cse().list(
+            **parameters).execute(http=get_http()))
+    except Exception as error:
+        # Degrade instead of ending the session: old results or none
+        res = RESULT_CACHE.get(search_engine_id, query, allow_stale=True,
+                               start=start)
+        print(f'Search failed ({error}), '
+              + ('serving cached results' if res else 'no results'))
+        return res or {'items': []}
+    if USE_RESULT_CACHE:
+        try:
+            RESULT_CACHE.put(search_engine_id, query, res, start=start)
+        except (OSError, TypeError, ValueError) as error:
+            # The search itself worked, only the cache file is not updated
+            print(f'Result cache not saved ({error})', file=sys.stderr)
+    return res
+
+
+def search_result_pool(json_api_key, search_engine_id, query, depth=None):
+    '''
+    Gets the first depth results, requesting all the pages concurrently
+    Input: json api key, search engine id, query,
+           number of results (RESULT_DEPTH if not given)
+    Output: list of result items in rank order, without repeated urls
+    '''
+    depth = depth or RESULT_DEPTH
+    starts = range(1, depth + 1, RESULTS_PER_PAGE)
+    if len(starts) == 1:
+        responses = [search(json_api_key, search_engine_id, query)]
+    else:
+        responses = PAGE_EXECUTOR.map(
+            lambda start: search(json_api_key, search_engine_id, query,
+                                 start), starts)
+    items = []
+    seen_urls = set()
+    for res in responses:
+        for item in res.get('items', []):
+            if item['formattedUrl'] not in seen_urls:
+                seen_urls.add(item['formattedUrl'])
+                items.append(item)
+    return items[:depth]
+
+
+def get_google_results(json_api_key, search_engine_id, query,
+                       mock_response=USE_MOCK, fetch_bodies=True,
+                       duplicate_index=None):
     '''
     Wrapper method for api call to json api to get google results for query
-    Input: search engine id, json api key, query
-    Output: list of formatted query results
+    Input: search engine id, json api key, query, whether to use the mock
+           response, whether to download full text now (when enabled),
+           index of the session's near-duplicate signatures
+    Output: list of formatted query results, RESULT_DEPTH of them at most.
+            Near-duplicates are collapsed into their best ranked result.
+            Only the ones ranked in the first RESULTS_PER_PAGE are shown
+            to the user, full text of the rest is loaded when needed
     '''
     res_list = []
     if mock_response:
-        res = {'items': MOCK_RESPONSE}
+        items = MOCK_RESPONSE
     else:
-        service = build("customsearch", "v1", developerKey=json_api_key)
-        res = service.cse().list(q=query, cx=search_engine_id).execute()
-    for i, item in enumerate(res['items']):
-        shortened_item = FormattedResponse(item, i, full_text=USE_FULL_TEXT)
+        with TRACER.span('api_call'):
+            items = search_result_pool(json_api_key, search_engine_id,
+                                       query)
+    for i, item in enumerate(items):
+        shortened_item = FormattedResponse(item, i)
         res_list.append(shortened_item)
+    TRACER.count('documents', len(res_list))
+    if USE_DEDUPLICATION:
+        with TRACER.span('deduplication'):
+            res_list = (duplicate_index or DuplicateIndex()).collapse(
+                res_list)
+        TRACER.count('duplicates', len(items) - len(res_list))
+    if USE_FULL_TEXT and fetch_bodies:
+        # Bodies are downloaded concurrently instead of one per result
+        fetch_full_text(get_first_page(res_list))
     return res_list
 
 
+def get_first_page(results):
+    '''
+    Results ranked in the first RESULTS_PER_PAGE, the ones judged
+    '''
+    return [result for result in results
+            if result.result_rank < RESULTS_PER_PAGE]
+
+
 def compute_total_query_count(feedback_dict):
     '''
     Getting total query results count
@@ -56,7 +265,9 @@ def compute_precision_10(feedback_dict):
     Output: Float representing precision@10 score
     '''
     count_yes = len(feedback_dict[RELEVANT_KEYWORD])
-    return count_yes/compute_total_query_count(feedback_dict)
+    total_count = compute_total_query_count(feedback_dict)
+    # No results (e.g. the api could not be reached) count as precision 0
+    return count_yes/total_count if total_count else 0.0
 
 
 def print_received_input(json_api_key, search_engine_id,
@@ -73,36 +284,52 @@ def print_received_input(json_api_key, search_engine_id,
     print(f'Precision  = {des_precision}')
 
 
+def is_session_over(res_precision, des_precision):
+    '''
+    Session ends when precision is 0 (nothing to learn from)
+    or when the desired precision is reached
+    '''
+    return res_precision == 0 or res_precision >= des_precision
+
+
 def print_feedback_summary(input_query, res_precision, des_precision):
     '''
-    Result summary for users,
-    Terminates program if precision is 0, or if desired precision reached.
+    Result summary for users
     Input: query, achieved Precision@10 score, desired Precision@10 score
-    Output: nothing returned, only print output
+    Output: True if the session is over (precision is 0, or desired
+            precision reached), False otherwise
     '''
     print('FEEDBACK SUMMARY')
     print(f'Query {input_query}')
     print(f'Precision {res_precision}')
     if res_precision == 0:
         print('Below desired precision, but can no longer augment the query')
-        sys.exit()
     elif res_precision < des_precision:
         print(f'Still below the desired precision of {des_precision}')
     else:
         print('Desired precision reached, done')
-        sys.exit()
+    return is_session_over(res_precision, des_precision)
+
+
+def ask_user(result):
+    '''
+    Default judge: asks the user at the terminal
+    Output: True if the user says the result is relevant
+    '''
+    answer = input('Relevant (Y/N)?')
+    # interpreting both upper case and lowercase responses
+    return answer.title() == 'Y'
 
 
-def get_relevance_feedback(results):
+def get_relevance_feedback(results, judge=ask_user, on_judgment=None):
     '''
     Display search results and get relevance feedback from users.
-    Input: list of dictionaries of each of the results, user input
-           for each of the displayed results
+    Input: list of dictionaries of each of the results, judge giving
+           the relevance of each of the displayed results, optional
+           function called with each result and its relevance
     Output: Dictionary containing 2 lists:
-            1st list: containing 1 string each for all documents declared
-                      relevant by user
-            2nd list: containing 1 string each for all documents declared
-                      irrelevant by user
+            1st list: containing all results declared relevant by user
+            2nd list: containing all results declared irrelevant by user
     '''
     feedback_dictionary = {
         RELEVANT_KEYWORD: [],
@@ -117,150 +344,341 @@ def get_relevance_feedback(results):
         print(f'URL: {result.url}')
         print(f'Title: {result.title}')
         print(f'Description: {result.description}')
+        for duplicate in get_first_page(result.duplicates):
+            print(f'Duplicate: {duplicate.url}')
         print(']')
         print()
 
-        answer = input('Relevant (Y/N)?')
+        with TRACER.span('user_think_time'):
+            relevant = judge(result)
+        if on_judgment:
+            on_judgment(result, relevant)
         print('----------------------')
         relevance = NOT_RELEVANT_KEYWORD  # defaulting to not relevant
 
-        # interpreting both upper case and lowercase responses
-        if answer.title() == 'Y':
+        if relevant:
             # changing to relevant only if indicated by user
             relevance = RELEVANT_KEYWORD
 
-        feedback_dictionary[relevance].append(result.joint_text)
+        # Near-duplicates share the result's corpus row, and so its
+        # judgment, but only count once for precision
+        feedback_dictionary[relevance].append(result)
 
     print('======================')
     return feedback_dictionary
 
 
-def get_augmented_query(input_query, search_results, relevance_feedback_dict):
+def get_augmented_query(input_query, search_results, relevance_feedback_dict,
+                        corpus=None, deep_results=()):
     '''
     Method for query logic expansion
     Input: Query, formatted search results (list of dictionaries),
-           Dictionary with relevance feedback
+           Dictionary with relevance feedback,
+           corpus of the previous rounds (a new one if not given),
+           results ranked below the judged page, used as not relevant
     Output: New, augmented query
     '''
 
     print('Indexing results ....')
 
-    # Create TfidfVectorizer instance here to pass through 2 functions:
-    # rocchio method and highest relevance word retriever
-    tf = TfidfVectorizer(analyzer='word', stop_words='english')
+    # The corpus is shared by 2 functions: rocchio method and
+    # highest relevance word retriever. Only new results are analyzed.
+    if corpus is None:
+        corpus = new_corpus()
+    with TRACER.span('vectorizer_fit'):
+        corpus.add_documents(search_results)
+        if deep_results:
+            # Full text of the deeper results is only needed from here on
+            if USE_FULL_TEXT:
+                fetch_full_text(deep_results)
+            corpus.add_documents(deep_results)
+            corpus.add_pseudo_judgments(deep_results)
+        corpus.add_judgments(relevance_feedback_dict,
+                             RELEVANT_KEYWORD, NOT_RELEVANT_KEYWORD)
+        corpus.tfidf_matrix()
+    TRACER.gauge('vocabulary_size', corpus.n_terms)
+    TRACER.gauge('corpus_documents', corpus.n_docs)
+
+    if EXPANSION_METHOD == 'bim':
+        with TRACER.span('bim'):
+            best_words = compute_bim_words(input_query, corpus)
+    else:
+        # Compute tf-idf vector for new query
+        with TRACER.span('rocchio'):
+            q_m_vector = compute_rocchio_query_vector(input_query, corpus)
 
-    # Compute tf-idf vector for new query
-    q_m_vector = compute_rocchio_query_vector(input_query, search_results,
-                                              relevance_feedback_dict, tf)
+        # From new query vector, get the highest scoring words not in query
+        with TRACER.span('term_selection'):
+            best_words = get_expansion_words(q_m_vector, corpus, input_query)
 
-    # From new query vector, get words sorted: highest to lowest tf-idf scores
-    new_query_terms = get_best_words(q_m_vector, tf)
+    return compose_query(input_query, best_words, corpus,
+                         np.flatnonzero(corpus.relevance == 1))
 
-    # Append words to query
-    augmented_words = []
-    for term in new_query_terms:
-        # Stop if 2 words selected
-        if len(augmented_words) == 2:
-            break
-        # If the term is already in the query, ignore
-        if term in input_query:
-            continue
-        augmented_words.append(term)
 
-    return input_query + ' ' + ' '.join(augmented_words)
+def compose_query(input_query, best_words, corpus, relevant_rows):
+    '''
+    Adds the expansion words to the query. With USE_QUERY_ORDERING, a word
+    forming a phrase in the relevant results with a query word (or another
+    new word) is put next to it, the others last, closest to the query
+    words first
+    Input: Query, list of (word, score) pairs, corpus instance, rows of the
+           relevant results
+    Output: New, augmented query
+    '''
+    augmented_words = [term for term, _ in best_words]
+    if not USE_QUERY_ORDERING or not len(relevant_rows):
+        return input_query + ' ' + ' '.join(augmented_words)
+    with TRACER.span('query_ordering'):
+        return corpus.positions.order_query(input_query, augmented_words,
+                                            relevant_rows)
 
 
-def compute_rocchio_query_vector(input_query, search_results,
-                                 relevance_feedback_dict, tfidf_vectorizer):
+def compute_rocchio_query_vector(input_query, corpus):
     '''
     Implements Rocchio to compute new query vector based on relevance feedback
-    Uses tf-idf vector to vectorize documents and queries
-    Input: Query, formatted search results (list of dictionaries),
-           Dictionary with relevance feedback, vectorizer object
+    from every round so far. Uses tf-idf vector to vectorize documents
+    and queries
+    Input: Query, corpus holding the judged results
     Output: Resultant query vector
     '''
 
-    # Creates list of documents to create tf-idf matrix
-    document_set = []
-    for res in search_results:
-        document_set.append(res.joint_text)
-
-    # Uses list of documents to create matrix
-    tfidf_matrix = tfidf_vectorizer.fit_transform(document_set)
+    # Tf-idf matrix of every result seen, rebuilt from stored term counts
+    tfidf_matrix = corpus.tfidf_matrix()
 
     # Uses matrix to convert input query into tf-idf vector
-    q_0_vector = tfidf_vectorizer.transform([input_query])
-
-    # Uses matrix to convert relevant, not-relevant documents
-    # into individual tf-idf vectors
-    relevant_doc_vectors, not_relevant_doc_vectors = get_doc_vectors(
-        relevance_feedback_dict, tfidf_vectorizer)
-
-    relevant_doc_sum = sum(relevant_doc_vectors)
-    not_relevant_doc_sum = sum(not_relevant_doc_vectors)
+    q_0_vector = corpus.transform(input_query)
 
-    len_relevant_doc = len(relevance_feedback_dict[RELEVANT_KEYWORD])
-    len_not_relevant_doc = len(relevance_feedback_dict[NOT_RELEVANT_KEYWORD])
+    # Centroids of relevant, not-relevant documents, one sparse
+    # matrix-vector product each over the judgment masks
+    relevant_centroid = compute_centroid(
+        tfidf_matrix, corpus.judgment_mask(True))
+    not_relevant_centroid = compute_centroid(
+        tfidf_matrix, corpus.judgment_mask(False))
 
     # Creating new query vector based on Rocchio's formula
-    q_m_vector = ALPHA * q_0_vector
-    q_m_vector += BETA * (1 / len_relevant_doc) * relevant_doc_sum
-    q_m_vector -= GAMMA * (1 / len_not_relevant_doc) * not_relevant_doc_sum
+    q_m_vector = ALPHA * q_0_vector.toarray().ravel()
+    q_m_vector += BETA * relevant_centroid
+    q_m_vector -= GAMMA * not_relevant_centroid
 
-    return q_m_vector
+    return sp.csr_matrix(q_m_vector)
 
 
-def get_doc_vectors(relevance_feedback_dict, tfidf_vectorizer):
+def compute_bim_words(input_query, corpus):
     '''
-    Uses matrix to convert relevant, not-relevant documents
-    into individual tf-idf vectors
+    Probabilistic alternative to Rocchio: weights terms of the judged
+    results with the Robertson/Sparck-Jones relevance weight
+    Input: Query, corpus holding the judged results
+    Output: list of (word, weight) pairs, reverse sorted based on weights
+    '''
+    judged_rows = np.flatnonzero(corpus.relevance)
+    # Same terms as the corpus (stop words, hashing), only the columns
+    # the judged results have
+    incidence = (corpus.counts_matrix()[judged_rows] > 0).astype(np.float64)
+    columns = np.flatnonzero(incidence.getnnz(axis=0))
+    relevant_mask = corpus.judgment_mask(True)[judged_rows]
+    return get_bim_words(
+        input_query, incidence[:, columns], corpus.terms_at(columns),
+        relevant_mask,
+        [corpus.documents[row].result_rank for row in judged_rows],
+        EXPANSION_SIZE)
+
+
+def compute_centroid(tfidf_matrix, mask):
+    '''
+    Average tf-idf vector of the documents selected by a 0/1 mask
+    Input: tf-idf matrix (documents x terms), mask over its rows
+    Output: dense centroid vector, zeros if no document is selected
+    '''
+    return (tfidf_matrix.T @ mask) / max(mask.sum(), 1)
 
-    Input: Dictionary with relevance feedback, vectorizer instance
-    Output: 2 lists of if-idf vectors for relevant and not relevant
-            documents respectively
+
+def get_best_words(query_idf, corpus, input_query='', k=EXPANSION_SIZE,
+                   stop_words=()):
+    '''
+    Selects the k highest scoring words of the tf-idf vector of query,
+    working on the sparse data and index arrays only
+    Input: tf-idf query vector, corpus instance, query whose words are
+           skipped, number of words, extra words to skip
+    Output: list of (word, score) pairs, reverse sorted based on scores
     '''
+    query_idf = sp.csr_matrix(query_idf)
+    scores = query_idf.data
+    terms = corpus.terms_at(query_idf.indices)
 
-    relevant_doc_vectors = generate_doc_vectors(
-        relevance_feedback_dict[RELEVANT_KEYWORD], tfidf_vectorizer)
-    not_relevant_doc_vectors = generate_doc_vectors(
-        relevance_feedback_dict[NOT_RELEVANT_KEYWORD], tfidf_vectorizer)
-    return relevant_doc_vectors, not_relevant_doc_vectors
+    # Skip words already in the query (as substrings) and stop words
+    keep = np.char.find(input_query, terms) < 0
+    if stop_words:
+        keep &= ~np.isin(terms, list(stop_words))
+    scores, terms = scores[keep], terms[keep]
 
+    # Partial selection: only words scoring at least the k-th best survive
+    if len(scores) > k:
+        kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+        top = scores >= kth_score
+        scores, terms = scores[top], terms[top]
 
-def generate_doc_vectors(doc_list, tfidf_vectorizer):
-    # return list of tf-idf vectors from list of strings
-    return [tfidf_vectorizer.transform([doc]) for doc in doc_list]
+    # Sort the survivors, ties alphabetically
+    order = np.lexsort((terms, -scores))[:k]
+    return [(str(terms[i]), float(scores[i])) for i in order]
 
 
-def get_best_words(query_idf, tfidf_vectorizer):
+def get_expansion_words(query_idf, corpus, input_query='',
+                        k=EXPANSION_SIZE):
     '''
-    Uses matrix to convert tf-idf vector of query into list of words
-    Input: tf-idf query vector, vectorizer instance
-    Output: list of words, reverse sorted based on scores
+    Best words of the Rocchio vector, also drawing on the neighbours of
+    its centroid in the word vectors when EMBEDDINGS_FILE is set. Every
+    candidate scores its Rocchio weight (relative to the best one) and
+    its cosine similarity to the centroid, mixed by EMBEDDING_WEIGHT
+    Input: tf-idf query vector, corpus instance, query whose words are
+           skipped, number of words
+    Output: list of (word, score) pairs, reverse sorted based on scores
     '''
+    if not EMBEDDINGS_FILE:
+        return get_best_words(query_idf, corpus, input_query, k)
+    embeddings = get_word_embeddings(EMBEDDINGS_FILE)
+    with TRACER.span('embeddings'):
+        centroid = embeddings.centroid(
+            get_best_words(query_idf, corpus, k=CENTROID_WORDS))
+        if centroid is None:
+            return get_best_words(query_idf, corpus, input_query, k)
+        rocchio_words = dict(get_best_words(
+            query_idf, corpus, input_query, EMBEDDING_NEIGHBOURS))
+        neighbours = dict(
+            (word, similarity) for word, similarity
+            in embeddings.neighbours(centroid, EMBEDDING_NEIGHBOURS)
+            if word not in input_query and word not in ENGLISH_STOP_WORDS)
+        similarities = embeddings.similarities(
+            centroid, [word for word in rocchio_words
+                       if word not in neighbours])
+        neighbours.update(similarities)
+
+        top_weight = max([abs(weight) for weight in rocchio_words.values()]
+                         or [1])
+        scores = [(word, (1 - EMBEDDING_WEIGHT)
+                   * rocchio_words.get(word, 0) / top_weight
+                   + EMBEDDING_WEIGHT * neighbours.get(word, 0))
+                  for word in set(rocchio_words) | set(neighbours)]
+    TRACER.count('embedding_words', len(set(neighbours) - set(rocchio_words)))
+    return sorted(scores, key=lambda pair: (-pair[1], pair[0]))[:k]
+
+
+def start_speculative_round(json_api_key, search_engine_id, input_query,
+                            search_results, corpus, deep_results=()):
+    '''
+    Starts fetching and indexing the results in the background,
+    so the work overlaps with the user's judgments
+    Input: API key, search engine id, query, formatted search results,
+           corpus of the session, results ranked below the judged page
+    Output: SpeculativeRound, to be given every judgment
+    '''
+    def prefetch_search(query):
+        search_result_pool(json_api_key, search_engine_id, query)
+
+    return SpeculativeRound(input_query, search_results, corpus, BACKGROUND,
+                            USE_FULL_TEXT, (ALPHA, BETA, GAMMA),
+                            get_expansion_words, compose_query,
+                            prefetch_search if SPECULATIVE_SEARCH else None,
+                            deep_results)
+
+
+def run_session(json_api_key, search_engine_id, raw_query,
+                desired_precision, judge=ask_user):
+    '''
+    Feedback loop: search, judge, expand, until the desired precision is
+    reached, precision drops to 0 or MAX_ATTEMPTS rounds are done
+    Input: API key, search engine id, query, desired Precision@10 score,
+           judge of each result (the user by default)
+    Output: list with one dictionary per round: query, precision and
+            seconds spent searching, judging and expanding the query
+    '''
+    # Results and judgments of every round, kept across iterations
+    corpus = new_corpus()
+    rounds = []
+    judged_rounds = []
+    initial_query = raw_query
+    duplicate_index = DuplicateIndex()
+
+    for i in range(MAX_ATTEMPTS):
+        TRACER.iteration = i + 1
+        print_received_input(json_api_key,
+                             search_engine_id,
+                             raw_query,
+                             desired_precision)
 
-    # Creating dictionary (index in matrix): score
-    rows, cols = query_idf.nonzero()
-    indices = []
-    for i in range(len(rows)):
-        indices.append((rows[i], cols[i]))
-    tfidf_dict = {}
-    for index in indices:
-        tfidf_dict[index] = query_idf[index]
+        start = time.perf_counter()
+        search_results = get_google_results(
+            json_api_key, search_engine_id, raw_query,
+            fetch_bodies=not USE_SPECULATION,
+            duplicate_index=duplicate_index)
+        search_time = time.perf_counter() - start
+        # Only the first page is judged, the rest feeds the expansion
+        custom_search_results = get_first_page(search_results)
+        deep_results = search_results[len(custom_search_results):]
+
+        speculation = None
+        if USE_SPECULATION:
+            speculation = start_speculative_round(
+                json_api_key, search_engine_id, raw_query,
+                custom_search_results, corpus, deep_results)
+
+        start = time.perf_counter()
+        relevance_feedback = get_relevance_feedback(
+            custom_search_results, judge,
+            speculation.judge if speculation else None)
+        feedback_time = time.perf_counter() - start
+        result_precision = compute_precision_10(relevance_feedback)
+        rounds.append({'query': raw_query,
+                       'precision': result_precision,
+                       'search_time': search_time,
+                       'feedback_time': feedback_time,
+                       'expansion_time': 0.0})
+        relevant_results = relevance_feedback[RELEVANT_KEYWORD]
+        judged_rounds.append({
+            'query': raw_query,
+            'results': [result.as_item() for result in custom_search_results],
+            'judgments': [any(result is relevant_result
+                              for relevant_result in relevant_results)
+                          for result in custom_search_results]})
+
+        if print_feedback_summary(raw_query,
+                                  result_precision,
+                                  desired_precision):
+            save_session(initial_query, desired_precision, judged_rounds)
+            return rounds
+
+        start = time.perf_counter()
+        if speculation and EXPANSION_METHOD == 'rocchio':
+            # Centroids were updated with each judgment, usually the
+            # augmented query is already computed
+            augmented_query = speculation.augmented_query()
+        else:
+            if speculation:
+                speculation.indexed.result()
+            augmented_query = get_augmented_query(raw_query,
+                                                  custom_search_results,
+                                                  relevance_feedback,
+                                                  corpus, deep_results)
+        rounds[-1]['expansion_time'] = time.perf_counter() - start
 
-    # Using inverse transform, get every word
-    inv = tfidf_vectorizer.inverse_transform(query_idf)
-    term_list = []
-    for tlist in inv:
-        for term in tlist:
-            term_list.append(term)
+        raw_query = augmented_query
+
+    print('Below desired precision, '
+          + 'but max number of attempts has been reached.')
+    save_session(initial_query, desired_precision, judged_rounds)
+    return rounds
 
-    # Combine scores and words, and sort words based on scores
-    word_scores = dict(zip(term_list, list(tfidf_dict.values())))
-    best_words = sorted(
-        word_scores, key=lambda k: word_scores[k], reverse=True)
 
-    return best_words
+def save_session(query, desired_precision, judged_rounds):
+    '''
+    Appends the session to SESSION_LOG (if set), one json line with the
+    query and the results and judgments of every round
+    '''
+    if not SESSION_LOG:
+        return
+    line = json.dumps({'query': query, 'precision': desired_precision,
+                       'rounds': judged_rounds}) + '\n'
+    with open(SESSION_LOG, 'a', encoding='utf-8') as session_file:
+        session_file.write(line)
 
 
 def main():
@@ -274,30 +692,14 @@ def main():
     JSON_API_KEY, SEARCH_ENGINE_ID = sys.argv[1], sys.argv[2]
     desired_precision, raw_query = float(sys.argv[3]), sys.argv[4]
 
-    for i in range(MAX_ATTEMPTS):
-        print_received_input(JSON_API_KEY,
-                             SEARCH_ENGINE_ID,
-                             raw_query,
-                             desired_precision)
-
-        custom_search_results = get_google_results(JSON_API_KEY,
-                                                   SEARCH_ENGINE_ID,
-                                                   raw_query)
-
-        relevance_feedback = get_relevance_feedback(custom_search_results)
-        result_precision = compute_precision_10(relevance_feedback)
-
-        print_feedback_summary(raw_query,
-                               result_precision,
-                               desired_precision)
-        augmented_query = get_augmented_query(raw_query,
-                                              custom_search_results,
-                                              relevance_feedback)
-
-        raw_query = augmented_query
-
-    print('Below desired precision, '
-          + 'but max number of attempts has been reached.')
+    TRACER.configure(TRACE_FILE, METRICS_FILE)
+    CASSETTE.configure(CASSETTE_FILE, CASSETTE_MODE)
+    try:
+        run_session(JSON_API_KEY, SEARCH_ENGINE_ID, raw_query,
+                    desired_precision)
+    finally:
+        CASSETTE.close()
+        TRACER.close()
 
 
 if __name__ == '__main__':
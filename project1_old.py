@@ -1,16 +1,10 @@
 import sys
 import re
 import math
-import requests
 from googleapiclient.discovery import build
 from mock_response import MOCK_RESPONSE
 from HttpResponse import FormattedResponse
-
-
-def get_stop_words():
-    return requests.get(
-        "http://www.cs.columbia.edu/"
-        + "~gravano/cs6111/proj1-stop.txt").text.split("\n")
+from stop_words import ENGLISH_STOP_WORDS
 
 
 '''
@@ -21,7 +15,7 @@ NOT_RELEVANT_KEYWORD = 'not_relevant'
 SEARCH_ENGINE_ID = ''
 JSON_API_KEY = ''
 MAX_ATTEMPTS = 5
-STOP_WORDS = get_stop_words()
+STOP_WORDS = ENGLISH_STOP_WORDS
 USE_FULL_TEXT = False
 USE_MOCK = False
 
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+'''
+Fixed Values
+'''
+RESULT_CACHE_TTL = 6 * 60 * 60  # seconds a search response stays valid
+RESULT_CACHE_MAX_ENTRIES = 512
+
+
+class ResultCache():
+    '''
+    Query keyed cache of Custom Search API responses.
+    Lives in memory and, when given a path, is mirrored to a json file so
+    responses survive between runs. Holds at most max_entries responses,
+    dropping the least recently used one first. The file is written to a
+    temporary file of its own and renamed over it, so processes sharing
+    it never read a partial file (the last one to save wins).
+    '''
+
+    def __init__(self, path=None, ttl=RESULT_CACHE_TTL,
+                 max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()  # key -> (stored, response)
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as cache_file:
+                for key, stored, response in json.load(cache_file):
+                    self.__entries[key] = (stored, response)
+
+    @staticmethod
+    def key(search_engine_id, query, start=1):
+        '''
+        Queries differing only in case or spacing share an entry
+        '''
+        key = search_engine_id + '|' + ' '.join(query.lower().split())
+        if start != 1:
+            key += f'|{start}'
+        return key
+
+    def get(self, search_engine_id, query, allow_stale=False, start=1):
+        '''
+        Input: search engine id, query, whether expired entries will do
+               (when the api can't be reached), rank of the first result
+        Output: cached api response, or None if missing or expired
+        '''
+        key = self.key(search_engine_id, query, start)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or (not allow_stale
+                                 and time.time() - entry[0] >= self.ttl):
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, search_engine_id, query, response, start=1):
+        key = self.key(search_engine_id, query, start)
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = (time.time(), response)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+            if self.path:
+                self.__save()
+
+    def __save(self):
+        cache_file = tempfile.NamedTemporaryFile(
+            'w', encoding='utf-8', delete=False, suffix='.tmp',
+            dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with cache_file:
+                json.dump([[key, stored, response] for key, (stored, response)
+                           in self.__entries.items()], cache_file)
+            os.replace(cache_file.name, self.path)
+        except BaseException:
+            os.remove(cache_file.name)
+            raise
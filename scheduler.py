@@ -0,0 +1,238 @@
+import datetime
+import email.utils
+import fcntl
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python 3.8 and older
+    from dateutil.tz import gettz as ZoneInfo
+
+'''
+Shared scheduler for outgoing requests (Custom Search API and page fetches).
+Every call waits for a token of its endpoint's bucket and, for page
+fetches, of the host's bucket; failed calls that are worth retrying are
+retried with jittered exponential backoff, honoring Retry-After, but
+never past the call's deadline (a page fetch gets its timeout in all,
+however many attempts it takes); calls to
+endpoints with a daily quota are counted, and once the quota is spent
+QuotaExhaustedError is raised right away so callers can degrade.
+The count is kept in QUOTA_FILE, so it covers every process of the day
+(each CLI session is one), not only the current one.
+'''
+
+'''
+Fixed Values
+'''
+ENDPOINT_RATES = {  # endpoint -> (requests per second, burst)
+    'customsearch': (1.0, 5),
+    'pages': (20.0, 20),
+}
+HOST_RATE = (2.0, 4)  # per host, for page fetches
+DAILY_QUOTAS = {'customsearch': 100}  # free tier of the Custom Search API
+MAX_RETRIES = 3
+BASE_DELAY = 0.5  # seconds
+MAX_DELAY = 8.0  # seconds, also caps Retry-After
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+QUOTA_REASONS = ('dailyLimitExceeded', 'Quota exceeded', 'quotaExceeded')
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')  # where Google's day ends
+QUOTA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '.quota_usage.json')
+
+
+class RetryableError(Exception):
+    '''
+    Raised by a request function for a response worth retrying
+    '''
+
+    def __init__(self, status, retry_after=None):
+        super().__init__(f'HTTP {status}')
+        self.status = status
+        self.retry_after = retry_after
+
+
+class QuotaExhaustedError(Exception):
+    pass
+
+
+class TokenBucket():
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Takes one token, sleeping until one is available
+        '''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens
+                                  + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_retry_after(value):
+    '''
+    Retry-After header (seconds or http date) as seconds, None if missing
+    '''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (date - datetime.datetime.now(date.tzinfo))
+               .total_seconds())
+
+
+def classify(error):
+    '''
+    Input: exception raised by a request
+    Output: (retryable, seconds asked by Retry-After, quota exhausted)
+    '''
+    if isinstance(error, RetryableError):
+        return True, parse_retry_after(error.retry_after), False
+    resp = getattr(error, 'resp', None)  # googleapiclient HttpError
+    if resp is not None:
+        status = int(resp.status)
+        if status in (403, 429) and any(reason in str(error)
+                                        for reason in QUOTA_REASONS):
+            return False, None, True
+        return (status in RETRY_STATUSES,
+                parse_retry_after(resp.get('retry-after')), False)
+    # Connection errors and timeouts (requests' errors are OSErrors too)
+    return isinstance(error, OSError), None, False
+
+
+class RequestScheduler():
+    def __init__(self, endpoint_rates=ENDPOINT_RATES, host_rate=HOST_RATE,
+                 daily_quotas=DAILY_QUOTAS, max_retries=MAX_RETRIES,
+                 quota_path=QUOTA_FILE):
+        self.endpoint_buckets = {endpoint: TokenBucket(*rate) for
+                                 endpoint, rate in endpoint_rates.items()}
+        self.host_rate = host_rate
+        self.host_buckets = {}
+        self.daily_quotas = dict(daily_quotas)
+        self.max_retries = max_retries
+        self.quota_path = quota_path  # None keeps the count in memory only
+        self.usage = {}  # endpoint -> (day, calls)
+        self.exhausted = {}  # endpoint -> day the api said quota was spent
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def quota_day():
+        # Google resets daily quotas at midnight Pacific time
+        return datetime.datetime.now(QUOTA_TIMEZONE).date().isoformat()
+
+    @contextmanager
+    def quota_state(self, write=False):
+        '''
+        Holds the thread lock and, with a quota file, its file lock, after
+        reading the usage of every process into usage and exhausted;
+        writes them back on exit if write is set
+        '''
+        with self.lock:
+            if not self.quota_path:
+                yield
+                return
+            with open(self.quota_path, 'a+', encoding='utf-8') as state:
+                fcntl.flock(state, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+                state.seek(0)
+                try:
+                    saved = json.loads(state.read() or '{}')
+                except ValueError:
+                    saved = {}  # cut by a crash, counting starts again
+                self.usage = {endpoint: tuple(entry) for endpoint, entry
+                              in saved.get('usage', {}).items()}
+                self.exhausted = saved.get('exhausted', {})
+                yield
+                if write:
+                    state.seek(0)
+                    state.truncate()
+                    state.write(json.dumps({'usage': self.usage,
+                                            'exhausted': self.exhausted}))
+                    state.flush()
+
+    def remaining_quota(self, endpoint):
+        '''
+        Calls left today, None if the endpoint has no daily quota
+        '''
+        if endpoint not in self.daily_quotas:
+            return None
+        day = self.quota_day()
+        with self.quota_state():
+            if self.exhausted.get(endpoint) == day:
+                return 0
+            used_day, calls = self.usage.get(endpoint, (day, 0))
+            used = calls if used_day == day else 0
+        return max(0, self.daily_quotas[endpoint] - used)
+
+    def __count(self, endpoint):
+        if endpoint not in self.daily_quotas:
+            return
+        day = self.quota_day()
+        with self.quota_state(write=True):
+            used_day, calls = self.usage.get(endpoint, (day, 0))
+            self.usage[endpoint] = (day, calls + 1 if used_day == day else 1)
+
+    def __host_bucket(self, host):
+        with self.lock:
+            if host not in self.host_buckets:
+                self.host_buckets[host] = TokenBucket(*self.host_rate)
+            return self.host_buckets[host]
+
+    def call(self, endpoint, request, host=None, deadline=None):
+        '''
+        Runs request() under the endpoint's (and host's) rate limits,
+        retrying transient failures
+        Input: endpoint name, function doing the request, host if any,
+               time.monotonic() after which no attempt is started
+        Output: what request returns
+        '''
+        for attempt in range(self.max_retries + 1):
+            if self.remaining_quota(endpoint) == 0:
+                raise QuotaExhaustedError(f'Daily quota of {endpoint} spent')
+            if endpoint in self.endpoint_buckets:
+                self.endpoint_buckets[endpoint].acquire()
+            if host:
+                self.__host_bucket(host).acquire()
+            self.__count(endpoint)
+            try:
+                return request()
+            except Exception as error:
+                retryable, retry_after, quota = classify(error)
+                if quota:
+                    with self.quota_state(write=True):
+                        self.exhausted[endpoint] = self.quota_day()
+                    raise QuotaExhaustedError(str(error)) from error
+                if not retryable or attempt == self.max_retries:
+                    raise
+                # Full jitter backoff, unless the server says how long
+                delay = random.uniform(
+                    0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+                if retry_after is not None:
+                    delay = min(MAX_DELAY, retry_after)
+                if deadline is not None and (time.monotonic() + delay
+                                             >= deadline):
+                    raise  # no time left for another attempt
+                time.sleep(delay)
+
+
+SCHEDULER = RequestScheduler()
@@ -0,0 +1,310 @@
+import json
+import os
+import re
+import socketserver
+import stat
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import project1
+from HttpResponse import get_html_session
+
+'''
+Long lived query expansion service.
+Keeps the heavy objects (imports, search client or offline index, html
+session) warm, loading them in the background as soon as it starts, and
+serves many feedback sessions at once over a local HTTP API:
+
+    POST   /sessions                 {"query": ..., "precision": 0.9}
+    GET    /sessions/<id>            current query, results and history
+    POST   /sessions/<id>/judgments  {"relevant": [true, false, ...]}
+    GET    /sessions/<id>/query      current (augmented) query
+    DELETE /sessions/<id>
+
+Judgments are given in the order of the results. Posting them ends the
+round: the response has the precision and, unless the session is over,
+the augmented query and its results.
+
+Start it with:
+    python3 service.py <Google API Key> <Google Search Engine ID>
+                       [<Port or Unix Socket Path>]
+'''
+
+'''
+Fixed Values
+'''
+DEFAULT_PORT = 8111
+SESSION_TTL = 60 * 60  # seconds an idle session is kept
+SESSION_PATH = re.compile(r'^/sessions/([0-9a-f]{32})(/judgments|/query)?$')
+
+
+class SessionError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class QuerySession():
+    '''
+    State of one feedback session: its corpus, current query and results
+    '''
+
+    def __init__(self, json_api_key, search_engine_id, query,
+                 desired_precision):
+        self.id = uuid.uuid4().hex
+        self.json_api_key = json_api_key
+        self.search_engine_id = search_engine_id
+        self.query = query
+        self.desired_precision = desired_precision
+        self.corpus = project1.new_corpus()
+        self.iteration = 0
+        self.status = 'running'
+        self.history = []
+        self.results = []
+        self.deep_results = []
+        self.duplicate_index = project1.DuplicateIndex()
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+        self.search()
+
+    def search(self):
+        self.iteration += 1
+        results = project1.get_google_results(
+            self.json_api_key, self.search_engine_id, self.query,
+            duplicate_index=self.duplicate_index)
+        self.results = project1.get_first_page(results)
+        self.deep_results = results[len(self.results):]
+
+    def judge(self, judgments):
+        '''
+        Ends the round with the user's judgments
+        Input: list of booleans, one per result
+        Output: nothing returned, session moves to the next round or ends
+        '''
+        if self.status != 'running':
+            raise SessionError(409, f'Session is {self.status}')
+        if len(judgments) != len(self.results):
+            raise SessionError(
+                400, f'Expected {len(self.results)} judgments')
+        feedback = {project1.RELEVANT_KEYWORD: [],
+                    project1.NOT_RELEVANT_KEYWORD: []}
+        for result, relevant in zip(self.results, judgments):
+            keyword = (project1.RELEVANT_KEYWORD if relevant
+                       else project1.NOT_RELEVANT_KEYWORD)
+            feedback[keyword].append(result)
+        precision = project1.compute_precision_10(feedback)
+        self.history.append({'query': self.query, 'precision': precision})
+
+        if project1.is_session_over(precision, self.desired_precision):
+            self.status = ('failed' if precision == 0 else 'reached')
+            return
+        if self.iteration == project1.MAX_ATTEMPTS:
+            self.status = 'exhausted'
+            return
+        self.query = project1.get_augmented_query(
+            self.query, self.results, feedback, self.corpus,
+            self.deep_results)
+        self.search()
+
+    def to_dict(self):
+        return {
+            'session': self.id,
+            'query': self.query,
+            'iteration': self.iteration,
+            'status': self.status,
+            'history': self.history,
+            'results': [{'rank': result.result_rank + 1,
+                         'url': result.url,
+                         'title': result.title,
+                         'description': result.description,
+                         'duplicates': [duplicate.url for duplicate in
+                                        project1.get_first_page(
+                                            result.duplicates)]}
+                        for result in self.results],
+        }
+
+
+class SessionStore():
+    '''
+    Sessions in memory, dropped once idle for longer than SESSION_TTL
+    '''
+
+    def __init__(self, json_api_key, search_engine_id):
+        self.json_api_key = json_api_key
+        self.search_engine_id = search_engine_id
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def create(self, query, desired_precision):
+        session = QuerySession(self.json_api_key, self.search_engine_id,
+                               query, desired_precision)
+        with self.lock:
+            self.expire()
+            self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            self.expire()
+            session = self.sessions.get(session_id)
+        if session is None:
+            raise SessionError(404, 'Unknown session')
+        session.last_used = time.time()
+        return session
+
+    def delete(self, session_id):
+        with self.lock:
+            if self.sessions.pop(session_id, None) is None:
+                raise SessionError(404, 'Unknown session')
+
+    def expire(self):
+        now = time.time()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_used > SESSION_TTL:
+                del self.sessions[session_id]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        '''
+        Request body, which has to be a json object
+        '''
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            raise SessionError(400, 'Body must be json')
+        if not isinstance(body, dict):
+            raise SessionError(400, 'Body must be a json object')
+        return body
+
+    def route(self, method):
+        store = self.server.store
+        if self.path == '/sessions' and method == 'POST':
+            body = self.read_json()
+            if 'query' not in body or 'precision' not in body:
+                raise SessionError(400, 'query and precision are required')
+            try:
+                precision = float(body['precision'])
+            except (TypeError, ValueError):
+                raise SessionError(400, 'precision must be a number')
+            return 201, store.create(body['query'], precision).to_dict()
+        match = SESSION_PATH.match(self.path)
+        if not match:
+            raise SessionError(404, 'Not found')
+        session_id, action = match.groups()
+        if method == 'DELETE' and action is None:
+            store.delete(session_id)
+            return 200, {'session': session_id, 'status': 'deleted'}
+        session = store.get(session_id)
+        with session.lock:
+            if method == 'GET' and action is None:
+                return 200, session.to_dict()
+            if method == 'GET' and action == '/query':
+                return 200, {'session': session.id, 'query': session.query}
+            if method == 'POST' and action == '/judgments':
+                judgments = self.read_json().get('relevant')
+                if not isinstance(judgments, list):
+                    raise SessionError(400, 'relevant must be a list')
+                session.judge([bool(judgment) for judgment in judgments])
+                return 200, session.to_dict()
+        raise SessionError(405, 'Method not allowed')
+
+    def handle_method(self, method):
+        try:
+            status, body = self.route(method)
+        except SessionError as error:
+            status, body = error.status, {'error': str(error)}
+        except Exception as error:
+            status, body = 500, {'error': repr(error)}
+        self.send_json(status, body)
+
+    def do_GET(self):
+        self.handle_method('GET')
+
+    def do_POST(self):
+        self.handle_method('POST')
+
+    def do_DELETE(self):
+        self.handle_method('DELETE')
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                              socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(json_api_key, search_engine_id, address=DEFAULT_PORT):
+    '''
+    Input: API key, search engine id, TCP port or Unix socket path
+    Output: server, not started yet (call serve_forever)
+    '''
+    if isinstance(address, int):
+        server = ThreadingHTTPServer(('127.0.0.1', address), RequestHandler)
+    else:
+        # A socket left by an earlier run is replaced, any other file kept
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            os.remove(address)
+        server = ThreadingUnixHTTPServer(address, RequestHandler)
+    server.store = SessionStore(json_api_key, search_engine_id)
+    return server
+
+
+def warm_up(json_api_key):
+    '''
+    Loads what the first session would otherwise wait for: the search
+    client (or the offline index) and, with full text, the html session
+    '''
+    try:
+        if project1.SEARCH_BACKEND:
+            project1.get_offline_index(project1.SEARCH_BACKEND)
+        elif not project1.USE_MOCK:
+            project1.get_search_service(json_api_key)
+        if project1.USE_FULL_TEXT:
+            get_html_session()
+    except Exception as error:
+        # Sessions load them again when they need them
+        print(f'Warm up failed: {error!r}', file=sys.stderr)
+
+
+def main():
+    '''
+    Main method
+    '''
+    if len(sys.argv) not in (3, 4):
+        sys.exit("Format: service.py <Google API Key> "
+                 + "<Google Search Engine ID> [<Port or Unix Socket Path>]")
+    address = DEFAULT_PORT
+    if len(sys.argv) == 4:
+        address = (int(sys.argv[3]) if sys.argv[3].isdigit()
+                   else sys.argv[3])
+    server = create_server(sys.argv[1], sys.argv[2], address)
+    threading.Thread(target=warm_up, args=(sys.argv[1],),
+                     daemon=True).start()
+    print(f'Serving on {address}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import threading
+import numpy as np
+import scipy.sparse as sp
+from HttpResponse import fetch_full_text
+from instrumentation import TRACER
+
+'''
+Work done while the user is judging a page of results.
+Full text is fetched and indexed in the background as soon as the results
+are shown, the Rocchio centroids are updated as each judgment comes in,
+and once only the last judgment is missing, the augmented query for both
+possible answers is computed (and optionally searched) ahead of time.
+'''
+
+
+class SpeculativeRound():
+    '''
+    One round of the feedback loop, run ahead of the user's judgments
+    Input: query, results of the round, corpus of the session, executor
+           for background work, whether to fetch full text,
+           (alpha, beta, gamma) Rocchio weights, function selecting the
+           best (word, score) pairs from a query vector, function
+           writing the next query from them and the relevant rows,
+           optional function searching a query ahead of time, results
+           ranked below the judged page (counted as not relevant)
+    '''
+
+    def __init__(self, query, results, corpus, executor, full_text, weights,
+                 select_words, compose_query, prefetch_search=None,
+                 deep_results=()):
+        self.query = query
+        self.results = results
+        self.corpus = corpus
+        self.executor = executor
+        self.full_text = full_text
+        self.alpha, self.beta, self.gamma = weights
+        self.select_words = select_words
+        self.compose_query = compose_query
+        self.prefetch_search = prefetch_search
+        self.deep_results = deep_results
+        self.__lock = threading.Lock()
+        self.__pending = []  # judgments received before indexing finished
+        self.__judged = 0
+        self.__sums = None  # relevance (1/-1) -> sum of tf-idf rows
+        self.__counts = None
+        self.__speculated = None  # future of {last judgment: query}
+        self.indexed = executor.submit(self.__index)
+
+    def __index(self):
+        '''
+        Background: fetch bodies, analyze the results, compute the
+        centroid sums of the judgments of previous rounds
+        '''
+        if self.full_text:
+            fetch_full_text(self.results)
+        with TRACER.span('vectorizer_fit', speculative=True):
+            self.corpus.add_documents(self.results)
+            if self.deep_results:
+                if self.full_text:
+                    fetch_full_text(self.deep_results)
+                self.corpus.add_documents(self.deep_results)
+                self.corpus.add_pseudo_judgments(self.deep_results)
+            tfidf_matrix = self.corpus.tfidf_matrix()
+        TRACER.gauge('vocabulary_size', self.corpus.n_terms)
+        TRACER.gauge('corpus_documents', self.corpus.n_docs)
+        with self.__lock:
+            self.__sums = {}
+            self.__counts = {}
+            for judgment in (1, -1):
+                mask = self.corpus.judgment_mask(judgment == 1)
+                self.__sums[judgment] = tfidf_matrix.T @ mask
+                self.__counts[judgment] = int(mask.sum())
+            for result, relevant in self.__pending:
+                self.__apply(result, relevant)
+            self.__pending = []
+        self.__maybe_speculate()
+
+    def __row_vector(self, row):
+        return self.corpus.tfidf_matrix()[row].toarray().ravel()
+
+    def __apply(self, result, relevant):
+        '''
+        Moves a result into the centroid sum of its judgment,
+        out of the one it had in an earlier round if any
+        '''
+        row = self.corpus.doc_index[result.url]
+        judgment = 1 if relevant else -1
+        previous = int(self.corpus.relevance[row])
+        if previous == judgment:
+            return
+        vector = self.__row_vector(row)
+        if previous:
+            self.__sums[previous] -= vector
+            self.__counts[previous] -= 1
+        self.__sums[judgment] += vector
+        self.__counts[judgment] += 1
+        self.corpus.relevance[row] = judgment
+
+    def judge(self, result, relevant):
+        '''
+        Called as soon as the user judges a result
+        '''
+        with self.__lock:
+            self.__judged += 1
+            if self.__sums is None:
+                self.__pending.append((result, relevant))
+            else:
+                self.__apply(result, relevant)
+        self.__maybe_speculate()
+
+    def __maybe_speculate(self):
+        '''
+        Once indexing is done and only the last result is left to judge,
+        computes the next query for both answers in the background
+        '''
+        with self.__lock:
+            if (self.__sums is None or self.__speculated is not None
+                    or self.__judged != len(self.results) - 1):
+                return
+            self.__speculated = self.executor.submit(self.__speculate)
+
+    def __speculate(self):
+        last = self.results[-1]
+        with self.__lock:
+            if self.__judged == len(self.results):
+                # Too late, the last judgment is already in the sums
+                return None
+            row = self.corpus.doc_index[last.url]
+            previous = int(self.corpus.relevance[row])
+            vector = self.__row_vector(row)
+            relevant_rows = np.flatnonzero(self.corpus.relevance == 1)
+            relevant_rows = relevant_rows[relevant_rows != row]
+            queries = {}
+            for judgment in (1, -1):
+                sums = dict(self.__sums)
+                counts = dict(self.__counts)
+                if previous:
+                    sums[previous] = sums[previous] - vector
+                    counts[previous] -= 1
+                sums[judgment] = sums[judgment] + vector
+                counts[judgment] += 1
+                queries[judgment == 1] = self.__augment(
+                    sums, counts, np.append(relevant_rows, row)
+                    if judgment == 1 else relevant_rows)
+        if self.prefetch_search:
+            for query in queries.values():
+                self.prefetch_search(query)
+        return queries
+
+    def __query_vector(self, sums, counts):
+        q_m_vector = self.alpha * self.corpus.transform(
+            self.query).toarray().ravel()
+        q_m_vector += self.beta * sums[1] / max(counts[1], 1)
+        q_m_vector -= self.gamma * sums[-1] / max(counts[-1], 1)
+        return sp.csr_matrix(q_m_vector)
+
+    def __augment(self, sums, counts, relevant_rows):
+        with TRACER.span('rocchio', speculative=True):
+            q_m_vector = self.__query_vector(sums, counts)
+        with TRACER.span('term_selection', speculative=True):
+            best_words = self.select_words(q_m_vector, self.corpus,
+                                           self.query)
+        return self.compose_query(self.query, best_words, self.corpus,
+                                  relevant_rows)
+
+    def augmented_query(self):
+        '''
+        Next query once every result is judged, usually already computed
+        '''
+        self.indexed.result()
+        queries = None
+        if self.__speculated is not None:
+            queries = self.__speculated.result()
+        if queries is not None:
+            row = self.corpus.doc_index[self.results[-1].url]
+            return queries[bool(self.corpus.relevance[row] == 1)]
+        with self.__lock:
+            return self.__augment(
+                self.__sums, self.__counts,
+                np.flatnonzero(self.corpus.relevance == 1))
+
+    def query_vector(self):
+        self.indexed.result()
+        with self.__lock:
+            return self.__query_vector(self.__sums, self.__counts)
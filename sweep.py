@@ -0,0 +1,229 @@
+import itertools
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+import project1
+from corpus import IncrementalCorpus
+from HttpResponse import FormattedResponse
+
+'''
+Rocchio parameter sweep over saved sessions (see SESSION_LOG in
+project1.py), without running any session again.
+
+For every round of a session, the feedback given so far expands the
+round's query with every (alpha, beta, gamma, expansion size) of the
+grid. Each expanded query ranks the documents judged in the whole
+session, and its precision@10 among them is compared with the ranking
+of the unexpanded query. The document-term matrix of a session is built
+once, and each round scores the whole grid with a few matrix products.
+Sessions are spread over a process pool.
+
+Only judged documents can be ranked, so this measures how well each
+setting separates what the user judged, not what a new search would
+return. MAX_ATTEMPTS can't be swept this way.
+
+    python3 sweep.py <sessions.jsonl> [<workers>] [<rows shown>]
+'''
+
+'''
+Fixed Values
+'''
+ALPHAS = [0.5, 1.0]
+BETAS = [0.25, 0.5, 0.75, 1.0]
+GAMMAS = [0.0, 0.15, 0.25, 0.5]
+EXPANSION_SIZES = [1, 2, 3, 4]
+TOP_K = 10
+DEFAULT_WORKERS = 4
+DEFAULT_ROWS = 20
+
+
+def read_sessions(path):
+    with open(path, encoding='utf-8') as sessions_file:
+        return [json.loads(line) for line in sessions_file if line.strip()]
+
+
+def get_grid():
+    '''
+    Output: list of (alpha, beta, gamma, expansion size) settings
+    '''
+    return list(itertools.product(ALPHAS, BETAS, GAMMAS, EXPANSION_SIZES))
+
+
+def index_session(session):
+    '''
+    Analyzes every result of the session once
+    Input: saved session
+    Output: corpus, list of (query, rows, judgments) per round
+    '''
+    corpus = IncrementalCorpus()
+    rounds = []
+    for judged_round in session['rounds']:
+        results = [FormattedResponse(item, rank)
+                   for rank, item in enumerate(judged_round['results'])]
+        corpus.add_documents(results)
+        rows = np.array([corpus.doc_index[result.url] for result in results],
+                        dtype=np.int64)
+        rounds.append((judged_round['query'], rows,
+                       np.array(judged_round['judgments'], dtype=bool)))
+    return corpus, rounds
+
+
+def query_counts(corpus, query):
+    '''
+    Term counts of the query over the corpus columns, as a 1 x n row
+    '''
+    counts = np.zeros(corpus.n_terms)
+    for term in corpus.analyzer(query):
+        column = corpus.vocabulary.get(term)
+        if column is not None:
+            counts[column] += 1
+    return sp.csr_matrix(counts)
+
+
+def weigh(corpus, counts):
+    '''
+    L2 normalized tf-idf rows from term counts, as the corpus weighs them
+    '''
+    weighted = sp.csr_matrix(counts @ sp.diags(corpus.idf()))
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)))
+    norms[norms == 0] = 1
+    return sp.csr_matrix(weighted.multiply(1 / norms))
+
+
+def precision_at_k(scores, relevance, k=TOP_K):
+    '''
+    Precision@k of the ranking of every row of scores (ties by document
+    order)
+    Input: settings x documents scores, boolean relevance per document
+    Output: precision per row
+    '''
+    top = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+    return relevance[top].mean(axis=1)
+
+
+def select_words(rocchio, eligible, max_size):
+    '''
+    Best words of every Rocchio vector, as get_best_words picks them:
+    highest weight first, ties alphabetically, zero weights never
+    Input: settings x terms vectors, eligible columns in alphabetical
+           order, number of words
+    Output: settings x max_size columns (fewer if fewer are eligible),
+            mask of the ones that exist
+    '''
+    scores = rocchio[:, eligible]
+    scores[scores == 0] = -np.inf
+    order = np.argsort(-scores, axis=1, kind='stable')[:, :max_size]
+    found = np.isfinite(np.take_along_axis(scores, order, axis=1))
+    return eligible[order], found
+
+
+def sweep_session(session, grid):
+    '''
+    Scores every setting of the grid on every round of a session
+    Input: saved session, list of (alpha, beta, gamma, expansion size)
+    Output: dictionary with the rounds scored, the summed precision of
+            the unexpanded queries and of each setting
+    '''
+    corpus, rounds = index_session(session)
+    tfidf_matrix = corpus.tfidf_matrix()
+    terms = corpus.term_array()
+    alphabetical = np.argsort(terms, kind='stable')
+
+    # Every document is judged by its last judgment
+    relevance = np.zeros(corpus.n_docs, dtype=np.int8)
+    for _, rows, judgments in rounds:
+        relevance[rows] = np.where(judgments, 1, -1)
+    relevant = relevance == 1
+
+    settings = np.array(grid)
+    weights = settings[:, :3] * [1, 1, -1]  # alpha, beta, -gamma
+    sizes = settings[:, 3].astype(np.int64)
+    max_size = int(sizes.max())
+
+    feedback = np.zeros(corpus.n_docs, dtype=np.int8)
+    baseline = 0.0
+    precision = np.zeros(len(grid))
+    for query, rows, judgments in rounds:
+        feedback[rows] = np.where(judgments, 1, -1)
+        counts = query_counts(corpus, query)
+        centroids = []
+        for judgment in (1, -1):
+            mask = (feedback == judgment).astype(np.float64)
+            centroids.append((tfidf_matrix.T @ mask) / max(mask.sum(), 1))
+        basis = np.vstack([weigh(corpus, counts).toarray().ravel()]
+                          + centroids)
+        rocchio = weights @ basis
+
+        # Words of the query (as substrings) are never added
+        eligible = alphabetical[
+            np.char.find(query, terms[alphabetical]) < 0]
+        columns, found = select_words(rocchio, eligible, max_size)
+        found &= np.arange(found.shape[1]) < sizes[:, None]
+        setting_rows = np.nonzero(found)[0]
+        added = sp.csr_matrix(
+            (np.ones(len(setting_rows)), (setting_rows, columns[found])),
+            shape=(len(grid), corpus.n_terms))
+        expanded = weigh(corpus,
+                         sp.csr_matrix(np.ones((len(grid), 1))) @ counts
+                         + added)
+
+        baseline += precision_at_k(
+            (weigh(corpus, counts) @ tfidf_matrix.T).toarray(), relevant)[0]
+        precision += precision_at_k(
+            (expanded @ tfidf_matrix.T).toarray(), relevant)
+    return {'rounds': len(rounds), 'baseline': baseline,
+            'precision': precision}
+
+
+def rank_settings(evaluations, grid):
+    '''
+    Aggregates the sessions, best mean precision@10 gain first
+    Output: list of (setting, mean precision, mean gain)
+    '''
+    n_rounds = sum(evaluation['rounds'] for evaluation in evaluations)
+    baseline = sum(evaluation['baseline'] for evaluation in evaluations)
+    precision = sum(evaluation['precision'] for evaluation in evaluations)
+    mean_precision = precision / max(n_rounds, 1)
+    gain = (precision - baseline) / max(n_rounds, 1)
+    order = np.argsort(-gain, kind='stable')
+    return [(grid[i], float(mean_precision[i]), float(gain[i]))
+            for i in order]
+
+
+def main():
+    '''
+    Main method
+    '''
+    if len(sys.argv) not in (2, 3, 4):
+        sys.exit("Format: sweep.py <Sessions JSONL> [<Workers>] "
+                 + "[<Rows Shown>]")
+    sessions = read_sessions(sys.argv[1])
+    if not sessions:
+        sys.exit(f'No sessions in {sys.argv[1]}, set SESSION_LOG in '
+                 + 'project1.py to save them')
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_WORKERS
+    n_rows = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_ROWS
+    grid = get_grid()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        evaluations = list(executor.map(sweep_session, sessions,
+                                        itertools.repeat(grid),
+                                        chunksize=4))
+    current = (project1.ALPHA, project1.BETA, project1.GAMMA,
+               project1.EXPANSION_SIZE)
+    print(f'{len(sessions)} sessions, '
+          + f'{sum(entry["rounds"] for entry in evaluations)} rounds')
+    print(f'{"rank":>4} {"alpha":>6} {"beta":>6} {"gamma":>6} {"words":>5} '
+          + f'{"p@10":>6} {"gain":>7}')
+    for rank, (setting, precision, gain) in enumerate(
+            rank_settings(evaluations, grid)[:n_rows], 1):
+        alpha, beta, gamma, size = setting
+        marker = ' (current)' if setting == current else ''
+        print(f'{rank:>4} {alpha:>6.2f} {beta:>6.2f} {gamma:>6.2f} '
+              + f'{int(size):>5} {precision:>6.3f} {gain:>+7.3f}{marker}')
+
+
+if __name__ == '__main__':
+    main()
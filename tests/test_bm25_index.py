@@ -0,0 +1,35 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bm25_index import BM25Index, build_index  # noqa: E402
+
+
+def test_pages_of_tied_results(tmp_path):
+    '''
+    50 documents with the same score: every page holds num results, and
+    the pages follow each other without gaps or repeats
+    '''
+    corpus = tmp_path / 'corpus.jsonl'
+    with open(corpus, 'w') as corpus_file:
+        for i in range(50):
+            corpus_file.write(json.dumps({
+                'url': f'http://d{i}', 'title': 'jaguar',
+                'text': f'jaguar cat d{i}'}) + '\n')
+        corpus_file.write(json.dumps({
+            'url': 'http://best', 'title': 'jaguar',
+            'text': 'jaguar jaguar habitat'}) + '\n')
+    build_index(str(corpus), str(tmp_path / 'index'))
+    index = BM25Index(str(tmp_path / 'index'))
+
+    urls = []
+    for start in (1, 11, 21, 31, 41, 51):
+        items = index.search('jaguar habitat', num=10, start=start)['items']
+        assert len(items) == (10 if start < 51 else 1)
+        urls.extend(item['formattedUrl'] for item in items)
+    assert urls[0] == 'http://best'
+    assert urls[1:] == [f'http://d{i}' for i in range(50)]
+    assert index.search('jaguar', num=10, start=52)['items'] == []
+    assert index.search('unknown', num=10)['items'] == []
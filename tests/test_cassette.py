@@ -0,0 +1,78 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cassette import RECORDING_SUFFIX, Cassette  # noqa: E402
+
+RESPONSE = {'items': [{'formattedUrl': 'http://a', 'title': 'Jaguar',
+                       'snippet': 'big cat'}]}
+
+
+def replay(path):
+    cassette = Cassette()
+    cassette.configure(path, 'replay')
+    return cassette
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'session.cassette')
+    recorder = Cassette()
+    recorder.configure(path, 'record')
+    recorder.put_response('engine', 'jaguar', RESPONSE)
+    recorder.put_page('http://a', 'jaguar café ' * 1000)
+    # Records are readable while recording
+    assert recorder.get_response('engine', 'jaguar') == RESPONSE
+    recorder.close()
+    assert not os.path.exists(path + RECORDING_SUFFIX)
+
+    player = replay(path)
+    assert player.get_response('engine', 'jaguar') == RESPONSE
+    assert player.get_response('engine', 'jaguar', start=11) is None
+    assert player.get_page('http://a') == 'jaguar café ' * 1000
+    assert player.get_page('http://b') is None
+    assert player.stats()['searches'] == 1
+    assert player.stats()['pages'] == 1
+    player.close()
+
+
+def test_cassette_readable_while_recording_into_it(tmp_path):
+    path = str(tmp_path / 'session.cassette')
+    recorder = Cassette()
+    recorder.configure(path, 'record')
+    recorder.put_page('http://a', 'first page')
+    recorder.close()
+
+    # A second recording adds to the cassette; until it is closed the
+    # cassette on disk still holds the first one only
+    recorder.configure(path, 'record')
+    recorder.put_page('http://b', 'second page')
+    assert recorder.get_page('http://a') == 'first page'
+    player = replay(path)
+    assert player.get_page('http://a') == 'first page'
+    assert player.get_page('http://b') is None
+    player.close()
+    recorder.close()
+
+    player = replay(path)
+    assert player.get_page('http://a') == 'first page'
+    assert player.get_page('http://b') == 'second page'
+    player.close()
+
+
+def test_killed_recording_leaves_the_cassette(tmp_path):
+    path = str(tmp_path / 'session.cassette')
+    recorder = Cassette()
+    recorder.configure(path, 'record')
+    recorder.put_page('http://a', 'first page')
+    recorder.close()
+    with open(path + RECORDING_SUFFIX, 'wb') as cut_recording:
+        cut_recording.write(b'\x78\x9c partial record')
+
+    player = replay(path)
+    assert player.get_page('http://a') == 'first page'
+    player.close()
+    with pytest.raises(ValueError):
+        replay(path + RECORDING_SUFFIX)
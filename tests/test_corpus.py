@@ -0,0 +1,68 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from corpus import IncrementalCorpus  # noqa: E402
+from HttpResponse import FormattedResponse  # noqa: E402
+
+ITEMS = [
+    {'formattedUrl': 'http://a', 'title': 'Jaguar - Wikipedia',
+     'snippet': 'The jaguar (Panthera onca) is a large cat species, the only '
+                'living Panthera species native to the Americas.'},
+    {'formattedUrl': 'http://b', 'title': 'Jaguar Cars',
+     'snippet': "Jaguar's F-TYPE and I-PACE: luxury cars, SUVs & sedans. "
+                'Book a test drive at a dealer near you, 24/7.'},
+    {'formattedUrl': 'http://c', 'title': 'Big cats of the Americas',
+     'snippet': 'Jaguars, pumas and ocelots hunt in the rainforest; '
+                'the jaguar is the largest of them all.'},
+    {'formattedUrl': 'http://d', 'title': 'Café Jaguar',
+     'snippet': 'Café, crêpes and jaguar-themed décor. Open 7 days a week.',
+     'body': 'Menu: espresso, café au lait, crêpes. Jaguar jaguar jaguar!'},
+    {'formattedUrl': 'http://e', 'title': 'Jaguar conservation',
+     'snippet': 'Habitat loss threatens the jaguar; corridors connect '
+                'populations from Mexico to Argentina.'},
+]
+
+
+def as_results(items):
+    return [FormattedResponse(item, i) for i, item in enumerate(items)]
+
+
+def test_weights_match_tfidf_vectorizer():
+    '''
+    Documents added over several rounds weigh the same as TfidfVectorizer
+    fitted on all of them at once, and so do queries
+    '''
+    text = pytest.importorskip('sklearn.feature_extraction.text')
+    results = as_results(ITEMS)
+    corpus = IncrementalCorpus()
+    corpus.add_documents(results[:2])
+    corpus.tfidf_matrix()
+    # Results seen in an earlier round are not added again
+    corpus.add_documents(results[1:])
+
+    vectorizer = text.TfidfVectorizer(analyzer='word', stop_words='english')
+    expected = vectorizer.fit_transform(
+        [result.joint_text for result in results]).toarray()
+    assert corpus.n_docs == len(ITEMS)
+    assert set(corpus.vocabulary) == set(vectorizer.vocabulary_)
+
+    # Columns of the corpus in the order of the vectorizer's
+    order = [corpus.vocabulary[term] for term in sorted(
+        vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)]
+    np.testing.assert_allclose(corpus.tfidf_matrix().toarray()[:, order],
+                               expected, atol=1e-12)
+    np.testing.assert_allclose(corpus.idf()[order], vectorizer.idf_,
+                               atol=1e-12)
+
+    query = 'Jaguar the CAT rainforest unknownword'
+    np.testing.assert_allclose(
+        corpus.transform(query).toarray()[:, order],
+        vectorizer.transform([query]).toarray(), atol=1e-12)
+    assert sorted(corpus.inverse_transform(corpus.transform(query))[0]) == \
+        sorted(vectorizer.inverse_transform(
+            vectorizer.transform([query]))[0])
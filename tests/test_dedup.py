@@ -0,0 +1,78 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import corpus  # noqa: E402
+import project1  # noqa: E402
+from dedup import DuplicateIndex  # noqa: E402
+from HttpResponse import FormattedResponse  # noqa: E402
+
+TEXT = 'jaguar habitat predator rainforest south america big cat species range'
+OTHERS = [{'formattedUrl': f'http://o{i}', 'title': f'other {i}',
+           'snippet': ' '.join(f'w{i}x{j}' for j in range(10))}
+          for i in range(8)]
+
+
+def test_mirror_found_in_a_later_round(monkeypatch):
+    '''
+    Round 1 returns A, round 2 returns A and its mirror C: C is judged
+    with A, shares A's corpus row and its judgment, and is not counted
+    again in precision@10
+    '''
+    calls = []
+    corpora = []
+
+    def search_result_pool(json_api_key, search_engine_id, query,
+                           depth=None):
+        calls.append(query)
+        items = [{'formattedUrl': 'http://a', 'title': 'Jaguar',
+                  'snippet': TEXT}]
+        if len(calls) > 1:
+            items.append({'formattedUrl': 'http://c', 'title': 'Jaguar',
+                          'snippet': TEXT})
+        return items + OTHERS
+
+    def new_corpus():
+        corpora.append(corpus.IncrementalCorpus())
+        return corpora[-1]
+
+    monkeypatch.setattr(project1, 'search_result_pool', search_result_pool)
+    monkeypatch.setattr(project1, 'new_corpus', new_corpus)
+    monkeypatch.setattr(project1, 'MAX_ATTEMPTS', 2)
+    for speculation in (False, True):
+        calls.clear()
+        monkeypatch.setattr(project1, 'USE_SPECULATION', speculation)
+        rounds = project1.run_session(
+            'key', 'engine', 'jaguar', 0.95,
+            lambda result: 'jaguar' in result.joint_text.lower())
+        assert len(rounds) == 2
+        # A and the 8 others are shown, C only as A's duplicate
+        assert rounds[1]['precision'] == 1 / 9
+
+        session_corpus = corpora[-1]
+        row = session_corpus.doc_index['http://a']
+        assert session_corpus.doc_index['http://c'] == row
+        assert session_corpus.relevance[row] == 1
+        assert len(session_corpus.documents) == 1 + len(OTHERS)
+
+
+def test_judgment_of_a_result_covers_its_duplicates():
+    results = [FormattedResponse({'formattedUrl': url, 'title': 'Jaguar',
+                                  'snippet': TEXT}, i)
+               for i, url in enumerate(('http://a', 'http://c'))]
+    results += [FormattedResponse(item, i + 2)
+                for i, item in enumerate(OTHERS)]
+    shown = DuplicateIndex().collapse(results)
+    assert [result.url for result in shown[0].duplicates] == ['http://c']
+
+    feedback = project1.get_relevance_feedback(
+        shown, lambda result: result.url == 'http://a')
+    assert project1.compute_precision_10(feedback) == 1 / 9
+
+    session_corpus = corpus.IncrementalCorpus()
+    session_corpus.add_documents(shown)
+    session_corpus.add_judgments(feedback, project1.RELEVANT_KEYWORD,
+                                 project1.NOT_RELEVANT_KEYWORD)
+    assert (session_corpus.relevance[session_corpus.doc_index['http://c']]
+            == 1)
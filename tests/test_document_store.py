@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from document_store import DocumentStore  # noqa: E402
+
+URLS_PER_WORKER = 50
+
+
+def text_of(url, version):
+    return f'{url} v{version} ' * (5 + len(url) % 7)
+
+
+def worker(directory, name, barrier):
+    '''
+    Appends pages, waits while the parent compacts, then replaces them
+    and reads the other worker's pages through the same open store
+    '''
+    store = DocumentStore(directory)
+    urls = [f'http://{name}/{i}' for i in range(URLS_PER_WORKER)]
+    for url in urls:
+        store.put(url, text_of(url, 1), worker=name)
+    barrier.wait()  # parent compacts
+    barrier.wait()
+    for url in urls:
+        store.put(url, text_of(url, 2), worker=name)
+        assert store.get(url) == text_of(url, 2)
+    other = 'w2' if name == 'w1' else 'w1'
+    for i in range(URLS_PER_WORKER):
+        url = f'http://{other}/{i}'
+        assert store.get(url) in (text_of(url, 1), text_of(url, 2))
+    store.close()
+
+
+def test_two_processes_append_across_a_compaction(tmp_path):
+    directory = str(tmp_path / 'store')
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(3)
+    store = DocumentStore(directory)
+    store.put('http://parent/deleted', 'deleted page')
+    workers = [context.Process(target=worker,
+                               args=(directory, name, barrier))
+               for name in ('w1', 'w2')]
+    for process in workers:
+        process.start()
+
+    barrier.wait(timeout=60)
+    store.delete('http://parent/deleted')
+    data_files = {name for name in os.listdir(directory)
+                  if name.endswith('.dat')}
+    store.compact()
+    assert ({name for name in os.listdir(directory)
+             if name.endswith('.dat')} != data_files)
+    assert store.data_bytes == store.live_bytes
+    barrier.wait(timeout=60)
+    for process in workers:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+    store.close()
+
+    store = DocumentStore(directory)
+    assert len(store) == 2 * URLS_PER_WORKER
+    for name in ('w1', 'w2'):
+        for i in range(URLS_PER_WORKER):
+            url = f'http://{name}/{i}'
+            assert store.get(url) == text_of(url, 2)
+            assert store.metadata(url) == {'worker': name}
+    assert store.get('http://parent/deleted') is None
+    store.close()
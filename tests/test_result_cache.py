@@ -0,0 +1,51 @@
+import json
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import project1  # noqa: E402
+from result_cache import ResultCache  # noqa: E402
+
+RESPONSE = {'items': [{'formattedUrl': 'http://a', 'title': 'Jaguar',
+                       'snippet': 'big cat ' * 50}]}
+
+
+def writer(path, name):
+    cache = ResultCache(path)
+    for i in range(100):
+        cache.put('engine', f'{name} query {i}', RESPONSE)
+
+
+def test_processes_sharing_the_file(tmp_path):
+    path = str(tmp_path / 'results.json')
+    context = multiprocessing.get_context('spawn')
+    writers = [context.Process(target=writer, args=(path, name))
+               for name in ('a', 'b', 'c')]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+    assert os.listdir(str(tmp_path)) == ['results.json']
+    with open(path, encoding='utf-8') as cache_file:
+        entries = json.load(cache_file)
+    # A whole file, from the last process to save: all its entries, and
+    # the ones of the others it loaded when it started
+    assert 100 <= len(entries) <= 300
+    assert all(response == RESPONSE for _, _, response in entries)
+    cache = ResultCache(path)
+    assert cache.get('engine', entries[-1][0].split('|')[1]) == RESPONSE
+
+
+def test_search_survives_a_cache_write_error(tmp_path, monkeypatch):
+    class Scheduler():
+        def call(self, endpoint, request, host=None, deadline=None):
+            return RESPONSE
+
+    monkeypatch.setattr(project1, 'SCHEDULER', Scheduler())
+    monkeypatch.setattr(project1, 'get_search_service', lambda key: None)
+    monkeypatch.setattr(project1, 'RESULT_CACHE', ResultCache(
+        str(tmp_path / 'missing' / 'results.json')))
+    assert project1.query_backend('key', 'engine', 'jaguar') == RESPONSE
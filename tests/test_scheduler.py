@@ -0,0 +1,72 @@
+import datetime
+import os
+import socket
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import scheduler  # noqa: E402
+from scheduler import (QuotaExhaustedError, RequestScheduler,  # noqa: E402
+                       RetryableError)
+
+
+def test_timeouts_are_not_retried_past_the_deadline():
+    attempts = []
+
+    def request():
+        attempts.append(time.monotonic())
+        time.sleep(0.2)
+        raise socket.timeout('read timed out')
+
+    requests = RequestScheduler(quota_path=None)
+    start = time.monotonic()
+    with pytest.raises(socket.timeout):
+        requests.call('pages', request, host='example.com',
+                      deadline=start + 0.3)
+    assert len(attempts) < 1 + requests.max_retries
+    assert time.monotonic() - start < 0.6
+
+
+def test_failures_are_retried_without_deadline(monkeypatch):
+    monkeypatch.setattr(scheduler, 'MAX_DELAY', 0.01)
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RetryableError(503)
+        return 'page'
+
+    requests = RequestScheduler(quota_path=None)
+    assert requests.call('pages', request, host='example.com') == 'page'
+    assert len(attempts) == 3
+
+
+def test_quota_day_is_pacific_time():
+    pacific = datetime.datetime.now(scheduler.QUOTA_TIMEZONE)
+    assert RequestScheduler.quota_day() == pacific.date().isoformat()
+    # Daylight saving time: UTC-7 in July, UTC-8 in January
+    summer = datetime.datetime(2026, 7, 1, tzinfo=scheduler.QUOTA_TIMEZONE)
+    winter = datetime.datetime(2026, 1, 1, tzinfo=scheduler.QUOTA_TIMEZONE)
+    assert summer.utcoffset() == datetime.timedelta(hours=-7)
+    assert winter.utcoffset() == datetime.timedelta(hours=-8)
+
+
+def test_quota_is_shared_through_the_quota_file(tmp_path):
+    path = str(tmp_path / 'quota.json')
+    first = RequestScheduler(daily_quotas={'customsearch': 3},
+                             quota_path=path)
+    second = RequestScheduler(daily_quotas={'customsearch': 3},
+                              quota_path=path)
+    first.call('customsearch', lambda: 'response')
+    second.call('customsearch', lambda: 'response')
+    assert first.remaining_quota('customsearch') == 1
+    first.call('customsearch', lambda: 'response')
+    with pytest.raises(QuotaExhaustedError):
+        second.call('customsearch', lambda: 'response')
+    # Calls without a quota are not counted
+    first.call('pages', lambda: 'page', host='example.com')
+    assert first.remaining_quota('pages') is None
@@ -0,0 +1,61 @@
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import project1  # noqa: E402
+import service  # noqa: E402
+
+ITEMS = [{'formattedUrl': f'http://r{i}', 'title': f'Jaguar {i}',
+          'snippet': ' '.join(f'w{i}x{j}' for j in range(10))}
+         for i in range(10)]
+
+
+@pytest.fixture
+def base_url(monkeypatch):
+    monkeypatch.setattr(project1, 'search_result_pool',
+                        lambda *args, **kwargs: ITEMS)
+    server = service.create_server('key', 'engine', 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, data):
+    request = urllib.request.Request(url, data=data, method='POST')
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+def test_bodies_that_are_not_objects(base_url):
+    status, session = post(base_url + '/sessions',
+                           b'{"query": "jaguar", "precision": 0.9}')
+    assert status == 201
+    judgments_url = f"{base_url}/sessions/{session['session']}/judgments"
+    for body in (b'[true, false]', b'"relevant"', b'3', b'null'):
+        status, answer = post(judgments_url, body)
+        assert status == 400
+        assert answer == {'error': 'Body must be a json object'}
+        assert post(base_url + '/sessions', body)[0] == 400
+    assert post(judgments_url, b'{"relevant": true}')[0] == 400
+    assert post(judgments_url, b'not json')[0] == 400
+    status, answer = post(base_url + '/sessions',
+                          b'{"query": "jaguar", "precision": "high"}')
+    assert status == 400
+    assert answer == {'error': 'precision must be a number'}
+
+    status, session = post(judgments_url, json.dumps(
+        {'relevant': [True] * len(ITEMS)}).encode('utf-8'))
+    assert status == 200
+    assert session['status'] == 'reached'
@@ -0,0 +1,130 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import project1  # noqa: E402
+
+ANIMAL = ('cat', 'rainforest', 'predator', 'habitat', 'panthera', 'prey',
+          'spotted', 'wildlife', 'amazon', 'species', 'conservation')
+CAR = ('car', 'engine', 'dealer', 'price', 'sedan', 'luxury', 'model',
+       'leasing', 'motors', 'review', 'interior')
+COMMON = ('jaguar', 'new', 'world', 'guide', 'photos', 'facts', 'latest')
+
+
+def make_pool(size=40, seed=6111):
+    '''
+    Results about the animal (even urls) and the car (odd urls), with a
+    few words of the other topic
+    '''
+    rng = random.Random(seed)
+    pool = []
+    for i in range(size):
+        topic, other = (ANIMAL, CAR) if i % 2 == 0 else (CAR, ANIMAL)
+        words = (['jaguar'] + rng.sample(topic, 5) + rng.sample(other, 2)
+                 + rng.sample(COMMON, 3) + [f'page{i}'])
+        rng.shuffle(words)
+        pool.append({'formattedUrl': f'http://r{i}', 'title': f'Jaguar {i}',
+                     'snippet': ' '.join(words)})
+    return pool
+
+
+POOL = make_pool()
+# Always judged last, its judgment decides the words added to the query
+PIVOT = {'formattedUrl': 'http://r100', 'title': 'Jaguar ocelot',
+         'snippet': 'jaguar ocelot margay serval caracal ocelot margay'}
+
+
+def rank(query):
+    '''
+    Results sharing the most words with the query first, the pivot last
+    of the first page
+    '''
+    terms = set(query.lower().split())
+    items = sorted(POOL, key=lambda item: -len(
+        terms & set(item['snippet'].split())))
+    items.insert(project1.RESULTS_PER_PAGE - 1, PIVOT)
+    return items
+
+
+def is_relevant(result, round_number, pivot_answers):
+    '''
+    Animal results are relevant, the pivot only in odd rounds unless
+    pivot_answers (round -> answer) says otherwise, so its judgment also
+    has to be moved between the centroids
+    '''
+    if result.url == PIVOT['formattedUrl']:
+        return pivot_answers.get(round_number, round_number % 2 == 1)
+    return int(result.url[len('http://r'):]) % 2 == 0
+
+
+def run(monkeypatch, speculation, pivot_answers=None):
+    '''
+    Runs a session; with speculation, the pivot's judgment waits until
+    both possible next queries are computed, so they are the ones used
+    Output: list of (query, precision) per round, list of
+            {pivot answer: speculated next query} per round
+    '''
+    state = {'round': 0, 'judging': False, 'searched': [], 'speculated': []}
+
+    def search_result_pool(json_api_key, search_engine_id, query,
+                           depth=None):
+        if state['judging']:
+            state['searched'].append(query)
+        else:
+            state['round'] += 1
+        return rank(query)[:depth or project1.RESULT_DEPTH]
+
+    def judge(result):
+        state['judging'] = speculation
+        if speculation and result.url == PIVOT['formattedUrl']:
+            deadline = time.time() + 10
+            while len(state['searched']) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            # Searched in the order of the answers, relevant first
+            state['speculated'].append(dict(zip((True, False),
+                                                state['searched'])))
+            state['searched'] = []
+            state['judging'] = False
+        return is_relevant(result, state['round'], pivot_answers or {})
+
+    monkeypatch.setattr(project1, 'search_result_pool', search_result_pool)
+    monkeypatch.setattr(project1, 'USE_SPECULATION', speculation)
+    monkeypatch.setattr(project1, 'SPECULATIVE_SEARCH', speculation)
+    rounds = project1.run_session('key', 'engine', 'jaguar', 1.0, judge)
+    return ([(round_['query'], round_['precision']) for round_ in rounds],
+            state['speculated'])
+
+
+def test_speculative_rounds_match_sequential_rounds(monkeypatch):
+    monkeypatch.setattr(project1, 'MAX_ATTEMPTS', 4)
+    monkeypatch.setattr(project1, 'RESULT_DEPTH', 20)
+    for method in ('rocchio', 'bim'):
+        monkeypatch.setattr(project1, 'EXPANSION_METHOD', method)
+        sequential, _ = run(monkeypatch, False)
+        # At least two expansions are compared
+        assert len({query for query, _ in sequential}) >= 3
+        rounds, speculated = run(monkeypatch, True)
+        assert rounds == sequential
+        assert len(speculated) == len(rounds)
+
+
+def test_both_speculated_queries_match_sequential_rounds(monkeypatch):
+    '''
+    The query speculated for each answer of the pivot is the next query
+    of a sequential session given that answer
+    '''
+    monkeypatch.setattr(project1, 'MAX_ATTEMPTS', 4)
+    monkeypatch.setattr(project1, 'RESULT_DEPTH', 20)
+    rounds, speculated = run(monkeypatch, True)
+    compared = 0
+    for round_number, queries in enumerate(speculated, 1):
+        assert set(queries) == {True, False}
+        for answer, query in queries.items():
+            sequential, _ = run(monkeypatch, False, {round_number: answer})
+            if len(sequential) > round_number:
+                assert sequential[round_number][0] == query
+                compared += 1
+    assert compared >= 4
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import sweep  # noqa: E402
+
+
+def test_no_sessions(tmp_path, monkeypatch):
+    path = tmp_path / 'sessions.jsonl'
+    path.write_text('\n')
+    monkeypatch.setattr(sys, 'argv', ['sweep.py', str(path)])
+    with pytest.raises(SystemExit) as exit_info:
+        sweep.main()
+    assert str(exit_info.value).startswith(f'No sessions in {path}')
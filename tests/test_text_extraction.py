@@ -0,0 +1,80 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from text_extraction import TextExtractor, extract_text  # noqa: E402
+
+
+class ChunkedResponse():
+    '''
+    Streamed response handing out the page in chunks of a given size
+    '''
+
+    def __init__(self, html, chunk_size, content_type='text/html'):
+        self.body = html.encode('utf-8')
+        self.chunk_size = chunk_size
+        self.headers = {'Content-Type': content_type}
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), self.chunk_size):
+            yield self.body[start:start + self.chunk_size]
+
+    def close(self):
+        pass
+
+
+def text_of(html):
+    extractor = TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text
+
+
+def test_head_without_end_tag():
+    assert text_of('<html><head><title>x</title><body><p>hello world</p>'
+                   '</body></html>') == 'hello world'
+    assert text_of('<head><title>x</title><meta charset="utf-8">'
+                   '<div>hello world</div>') == 'hello world'
+
+
+def test_content_wrapping_tags_are_kept():
+    assert text_of('<html><body><form action="/"><header>site name</header>'
+                   '<div>hello world</div><button>go</button>'
+                   '<select><option>one</option></select></form>'
+                   '</body></html>') == 'site name hello world go one'
+
+
+def test_skipped_tags():
+    assert text_of('<head><title>x</title><style>p {}</style></head>'
+                   '<body><nav>menu</nav><p>hello</p><script>var a;</script>'
+                   '<footer>contact</footer></body>') == 'hello'
+
+
+def test_unclosed_script_and_style():
+    assert text_of('<body><p>hello world</p><script>var a = "<p>x</p>";'
+                   ) == 'hello world'
+    assert text_of('<body><p>hello world</p><style>p { color: red }'
+                   ) == 'hello world'
+
+
+def test_words_across_chunk_boundaries():
+    html = ('<html><head><title>t</title></head><body><p>jaguar habitat '
+            'rainforest &amp; café predators</p><p>big cat</p></body>'
+            '</html>')
+    expected = 'jaguar habitat rainforest & café predators big cat'
+    for chunk_size in (1, 2, 3, 7, 16384):
+        text, downloaded = extract_text(ChunkedResponse(html, chunk_size))
+        assert text == expected
+        assert downloaded == len(html.encode('utf-8'))
+
+
+def test_word_budget():
+    text, _ = extract_text(ChunkedResponse('<p>a1 b2 c3 d4 e5</p>', 3),
+                           max_words=3)
+    assert text == 'a1 b2 c3'
+
+
+def test_not_html():
+    assert extract_text(ChunkedResponse('%PDF-1.4', 4,
+                                        'application/pdf')) == ('', 0)
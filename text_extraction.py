@@ -0,0 +1,139 @@
+import codecs
+from html.parser import HTMLParser
+
+'''
+Streaming html to text extraction.
+Pages are parsed chunk by chunk as they are downloaded, only the visible
+words are kept, and the download stops once a byte or word budget is
+reached, so memory per page stays bounded whatever the page size.
+'''
+
+'''
+Fixed Values
+'''
+MAX_BODY_BYTES = 1024 * 1024
+MAX_BODY_WORDS = 5000
+CHUNK_SIZE = 16 * 1024
+SKIPPED_TAGS = {'script', 'style', 'noscript', 'nav', 'template', 'svg',
+                'iframe', 'footer'}
+# Tags that can be in <head>: any other one starts the body, as </head>
+# and <body> are optional
+HEAD_TAGS = {'title', 'meta', 'link', 'base', 'style', 'script',
+             'noscript', 'template'}
+
+
+class TextExtractor(HTMLParser):
+    '''
+    Event driven parser keeping the words of the body outside of
+    SKIPPED_TAGS.
+    Text cut by the end of a chunk reaches handle_data in two calls, so the
+    last word of a call is held back until more text, a tag or the end
+    shows where it ends.
+    '''
+
+    def __init__(self, max_words=MAX_BODY_WORDS):
+        super().__init__(convert_charrefs=True)
+        self.max_words = max_words
+        self.words = []
+        self.skip_depth = 0
+        self.in_head = False
+        self.partial = ''  # last word seen, possibly not complete yet
+
+    @property
+    def done(self):
+        return len(self.words) >= self.max_words
+
+    def add_words(self, words):
+        self.words.extend(words[:self.max_words - len(self.words)])
+
+    def flush(self):
+        '''
+        The held back word is complete
+        '''
+        if self.partial:
+            self.add_words([self.partial])
+            self.partial = ''
+
+    def handle_starttag(self, tag, attrs):
+        self.flush()
+        if tag == 'head':
+            self.in_head = True
+        elif self.in_head and tag not in HEAD_TAGS:
+            self.in_head = False
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        # Self closing tags (<svg/>) open nothing
+        self.flush()
+
+    def handle_endtag(self, tag):
+        self.flush()
+        if tag == 'head':
+            self.in_head = False
+        elif tag in SKIPPED_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if self.in_head or self.skip_depth or self.done:
+            return
+        words = (self.partial + data).split()
+        self.partial = ''
+        if words and not data[-1].isspace():
+            self.partial = words.pop()
+        self.add_words(words)
+
+    def close(self):
+        super().close()
+        self.flush()
+
+    @property
+    def text(self):
+        return ' '.join(self.words)
+
+
+def get_encoding(response):
+    '''
+    Charset announced in the Content-Type header, utf-8 otherwise
+    '''
+    content_type = response.headers.get('Content-Type', '')
+    for parameter in content_type.split(';')[1:]:
+        name, _, value = parameter.partition('=')
+        if name.strip().lower() == 'charset' and value.strip():
+            try:
+                return codecs.lookup(value.strip().strip('"\'')).name
+            except LookupError:
+                break
+    return 'utf-8'
+
+
+def is_html(response):
+    content_type = response.headers.get('Content-Type', '').lower()
+    return not content_type or 'html' in content_type
+
+
+def extract_text(response, max_bytes=MAX_BODY_BYTES,
+                 max_words=MAX_BODY_WORDS):
+    '''
+    Extracts the visible text of a streamed (stream=True) response
+    Input: response, byte budget, word budget
+    Output: extracted text, number of bytes downloaded
+    '''
+    if not is_html(response):
+        response.close()
+        return '', 0
+    extractor = TextExtractor(max_words)
+    decoder = codecs.getincrementaldecoder(get_encoding(response))(
+        errors='replace')
+    downloaded = 0
+    try:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            downloaded += len(chunk)
+            extractor.feed(decoder.decode(chunk))
+            if extractor.done or downloaded >= max_bytes:
+                break
+        extractor.feed(decoder.decode(b'', final=True))
+        extractor.close()
+    finally:
+        response.close()
+    return extractor.text, downloaded